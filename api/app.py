@@ -1,14 +1,68 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from core import config
+from core import metrics
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from core import compaction
+    from core import lobbies
+    from core import registry
+    from core import retention
+    from core import scheduler
+    from database import writer
+    from ws import wsManager
+
+    await wsManager.backend.start()
+    await lobbies.load()
+
+    # background persistence of the live games, the last batch is written on shutdown
+    flusher = asyncio.create_task(registry.runFlusher())
+
+    # timers pending from the previous run fire right away if they are already due
+    await scheduler.restore()
+    timers = asyncio.create_task(scheduler.runScheduler())
+
+    # deletes the games past their retention age every retention_interval seconds
+    cleaner = asyncio.create_task(retention.runRetention())
+
+    # heartbeats the sockets and reaps the ones that went silent
+    sweeper = asyncio.create_task(wsManager.runSweeper())
+
+    # packs the rounds of the games finished before packed rounds existed
+    compaction.start()
+
+    yield
+
+    sweeper.cancel()
+    compaction.task.cancel()
+    cleaner.cancel()
+    if retention.task:
+        retention.task.cancel()
+    timers.cancel()
+    flusher.cancel()
+    await registry.flush()
+    await scheduler.flush()
+    await writer.stop()
+    await wsManager.backend.stop()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
-app = FastAPI()
+if config.sql_profiling:
+    from database import profiler
+    app.add_middleware(profiler.ProfilerMiddleware)
 
 def runApp():
     # Routes
     from api.routes import game
     from api.routes import admin
+    from api.routes import monitoring
+    from ws import matchmaking
     from ws import wsManager
 
     app.add_middleware(
@@ -20,7 +74,7 @@ def runApp():
     )
 
     # Running the actual uvicorn server
-    uvicorn.run(app, host=config.uvicorn_host, port=config.uvicorn_port)
+    uvicorn.run(app, host=config.uvicorn_host, port=config.uvicorn_port, ws_ping_interval=config.ws_ping_interval, ws_ping_timeout=config.ws_ping_timeout)
 
 def getApp():
     global app
@@ -1,13 +1,19 @@
 
 import uuid
-from fastapi import HTTPException
+from fastapi import HTTPException, Response
 from pydantic import BaseModel
 from api.app import getApp
+from core import archive
+from core import compaction
 from core import config
+from core import lobbies
+from core import matchmaking
+from core import retention
+from core import scheduler
+from ws import wsManager
 from database import session as db
-from datetime import datetime, timedelta, timezone
-
-from models.game_model import Game
+from database import profiler
+from database import writer
 
 app = getApp()
 
@@ -27,26 +33,73 @@ def login(request: LoginRequest):
 class CleanupRequest(BaseModel):
     admin_token: str
 
+#
+#   Starts a run of the retention worker, which deletes the expired games in the background,
+#   and reports its progress. A run already in progress is left to finish.
+#
+
 @app.post("/api/v1/admin/cleanup")
-def cleanup(request: CleanupRequest):
+async def cleanup(request: CleanupRequest):
     if not config.admin_token:
         raise HTTPException(status_code=401, detail="Not logged in!")
 
     if request.admin_token != config.admin_token:
         raise HTTPException(status_code=401, detail="Invalid token!")
 
-    session = db.getSession()
-    one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
-    games = session.query(Game).filter(Game.created_at < one_hour_ago).all()
-
-    for game in games:
-        try:
-            for round in game.rounds:
-                session.delete(round)
-            session.delete(game)
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise HTTPException(status_code=500, detail=f"Error deleting game: {str(e)}")
-
-    return {"message": "Cleanup completed successfully!"}
\ No newline at end of file
+    started = retention.start()
+
+    return {
+        "message": "Cleanup started!" if started else "Cleanup already running!",
+        "progress": retention.getProgress(),
+    }
+
+@app.get("/api/v1/admin/cleanup")
+async def cleanup_progress(admin_token: str = None):
+    if admin_token != config.admin_token:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+    return retention.getProgress()
+
+@app.get("/api/v1/admin/stats")
+async def stats(admin_token: str = None):
+    if admin_token != config.admin_token:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+    return {
+        "timers": scheduler.getStats(),
+        "websockets": wsManager.getStats(),
+        "broadcast": wsManager.backend.getStats(),
+        "matchmaking": matchmaking.getStats(),
+        "lobby_stream": lobbies.getStats(),
+        "compaction": compaction.getProgress(),
+        "archive": archive.getStats(),
+        "database_pool": db.getPoolStats(),
+        "database_writer": writer.getStats(),
+    }
+
+#
+#   Report of the SQL profiler (config.sql_profiling): statements per route, likely N+1
+#   patterns and the latest slow statements with their query plan
+#
+
+@app.get("/api/v1/admin/profile")
+async def profile(admin_token: str = None):
+    if admin_token != config.admin_token:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+    return profiler.getReport()
+
+#
+#   A game moved to the archive by the retention worker, read back from its segment file
+#
+
+@app.get("/api/v1/admin/archive/{game_id}")
+async def archived_game(game_id: str, admin_token: str = None):
+    if admin_token != config.admin_token:
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+    game = archive.read(game_id)
+    if game is None:
+        raise HTTPException(status_code=404, detail="Game not found in the archive.")
+
+    return Response(content=game, media_type="application/json")
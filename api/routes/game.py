@@ -2,110 +2,219 @@
 import asyncio
 import datetime
 import re
+import time
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel
-from misc.functions import generate_game_code
-from models.round_model import Round
+from misc.functions import decode_cursor, encode_cursor, generate_game_code
 from ws.wsManager import notify_game_status
+from core import archive
 from core import config
+from core import lobbies
+from core import packing
+from core import registry
+from core import rules
+from core import scheduler
+from core import serialization
 from database import session as db
-from fastapi import HTTPException, Header
-from sqlalchemy.orm import joinedload
-from sqlalchemy import case
+from fastapi import Depends, HTTPException, Header, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import selectinload
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
  
 from api.app import getApp
  
 from models.game_model import Game
  
 app = getApp()
- 
+
+# seconds a player has to make a choice, and to rejoin after disconnecting
+ROUND_TIME = 60
+DISCONNECT_TIME = 60 if config.debug else 600
+
 #
-#   Returns an array with all the stored games if there are no parameters given
-#   or returns an array with all the games filtered by the arguments
+#   Shapes of the game responses. The hot endpoints return pre-encoded bytes,
+#   so these document the API without validating every response.
 #
+
+class RoundResponse(BaseModel):
+    round_number: int
+    player1_choice: Optional[str] = None
+    player2_choice: Optional[str] = None
+    player1_score: Optional[int] = None
+    player2_score: Optional[int] = None
+    created_at: str
+
+class GameResponse(BaseModel):
+    id: str
+    code: str
+    player1_name: Optional[str] = None
+    player2_name: Optional[str] = None
+    player1_score: Optional[int] = None
+    player2_score: Optional[int] = None
+    player1_disconnected_at: Optional[datetime.datetime] = None
+    player2_disconnected_at: Optional[datetime.datetime] = None
+    current_round: int
+    game_state: str
+    public_lobby: bool
+    created_at: datetime.datetime
+    finished_at: Optional[datetime.datetime] = None
+    seq: int
+    rounds: Optional[List[RoundResponse]] = None
+
+class GamesPage(BaseModel):
+    page_size: int
+    next_cursor: Optional[str] = None
+    found_games: int
+    games: List[GameResponse]
+
+class GameEvents(BaseModel):
+    seq: int
+    events: Optional[List[dict]] = None
+    snapshot: Optional[GameResponse] = None
  
-@app.get("/api/v1/games")
+#
+#   Returns a page of the stored games, active ones first and then newest first, optionally
+#   filtered by state. Pages are chained through next_cursor, so a deep page costs the same as
+#   the first one. With include_rounds=false the rounds of the games aren't loaded.
+#
+
+# total per state filter, recounted at most every count_cache_ttl seconds
+game_counts: Dict[Optional[str], Tuple[float, int]] = {}
+
+async def count_games(session, game_state: Optional[str]) -> int:
+    cached = game_counts.get(game_state)
+    if cached and time.monotonic() - cached[0] < config.count_cache_ttl:
+        return cached[1]
+
+    statement = select(func.count()).select_from(Game)
+    if game_state:
+        statement = statement.where(Game.game_state == game_state)
+
+    count = (await session.execute(statement)).scalar_one()
+    game_counts[game_state] = (time.monotonic(), count)
+    return count
+
+@app.get("/api/v1/games", response_model=GamesPage)
 async def list_games(
-    page: int = 1,
+    cursor: str = None,
     page_size: int = 10,
+    include_rounds: bool = True,
     admin_token: str = None,
-    game_state: str = None
+    game_state: str = None,
+    session: AsyncSession = Depends(db.getRequestSession)
 ):
     if admin_token != config.admin_token:
         raise HTTPException(status_code=403, detail="Invalid admin token.")
-    
-    if page < 1:
-        raise HTTPException(status_code=400, detail="Page must be greater than 0.")
 
-    session = db.getSession()
-    dbGames = session.query(Game)
+    if page_size < 1 or page_size > 100:
+        raise HTTPException(status_code=400, detail="Page size must be between 1 and 100.")
+
+    after = None
+    if cursor:
+        try:
+            priority, created_at, game_id = decode_cursor(cursor)
+            after = (int(priority), datetime.datetime.fromisoformat(created_at), str(game_id))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
 
+    # the listing reads the database, so the live games are written back first
+    await registry.flush()
+
+    # active games come first: each priority is read on its own so both walk an index in order
+    segments = [(0, Game.game_state == "active"), (1, Game.game_state != "active")]
     if game_state:
-        dbGames = dbGames.filter(Game.game_state == game_state)
+        segments = [(0 if game_state == "active" else 1, Game.game_state == game_state)]
+
+    games = []
+    for priority, condition in segments:
+        if after and priority < after[0]:
+            continue
+
+        dbGames = select(Game).where(condition)
+        if after and priority == after[0]:
+            dbGames = dbGames.where(tuple_(Game.created_at, Game.id) < (after[1], after[2]))
+        if include_rounds:
+            dbGames = dbGames.options(selectinload(Game.rounds))
+
+        # one more than the page holds, to know whether there is a next one
+        rows = (await session.execute(dbGames.order_by(
+            Game.created_at.desc(),
+            Game.id.desc()
+        ).limit(page_size + 1 - len(games)))).scalars().all()
+        games.extend((priority, game) for game in rows)
+
+        if len(games) > page_size:
+            break
 
-    games = dbGames.options(joinedload(Game.rounds)).order_by(
-        case((Game.game_state == "active", 0), else_=1),
-        Game.created_at.desc()
-    ).offset((page - 1) * page_size).limit(page_size).all()
-    total_games_size = dbGames.count()
+    total_games_size = await count_games(session, game_state)
+
+    next_cursor = None
+    if len(games) > page_size:
+        games = games[:page_size]
+        priority, game = games[-1]
+        next_cursor = encode_cursor([priority, game.created_at.isoformat(), game.id])
 
     result = {
-        "page": page,
         "page_size": page_size,
+        "next_cursor": next_cursor,
         "found_games": total_games_size,
-        "games": [
-            {
-                "id": game.id,
-                "code": game.code,
-                "player1_name": game.player1_name,
-                "player2_name": game.player2_name,
-                "player1_score": game.player1_score,
-                "player2_score": game.player2_score,
-                "player1_disconnected_at": game.player1_disconnected_at,
-                "player2_disconnected_at": game.player2_disconnected_at,
-                "current_round": len(game.rounds),
-                "game_state": game.game_state,
-                "public_lobby": game.public_lobby,
-                "created_at": game.created_at,
-                "finished_at": game.finished_at,
-                "rounds": [
-                    {
-                        "round_number": r.round_number,
-                        "player1_choice": r.player1_choice,
-                        "player2_choice": r.player2_choice,
-                        "player1_score": r.player1_score,
-                        "player2_score": r.player2_score,
-                        "created_at": r.created_at,
-                    }
-                    for r in game.rounds
-                ]
-            }
-            for game in games
-        ]
+        "games": [serialize_game(game, include_rounds) for _, game in games]
     }
-    session.close()
-    return result
+
+    return Response(content=serialization.dumps(result), media_type="application/json")
  
 #
-#   Returns an array with all stored games that are in public lobby mode
+#   Returns an array with all stored games that are in public lobby mode, newest first.
+#   Pages are chained through next_cursor.
 #
 
 @app.get("/api/v1/games/public")
-async def get_public_games():
-    session = db.getSession()
-    games = session.query(Game).options(joinedload(Game.rounds)).filter(Game.public_lobby == True, Game.game_state == "waiting").order_by(Game.created_at.desc())
+async def get_public_games(cursor: str = None, limit: int = 50, if_none_match: str = Header(None)):
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="Limit must be between 1 and 100.")
 
-    result = {
-        "games": [
-            {
-                "id": game.id,
-                "code": game.code,
-                "player1_name": game.player1_name
-            } for game in games
-        ]
-    }
+    # served from the lobby index, an unchanged listing costs the client a 304
+    etag = lobbies.getEtag()
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
 
-    session.close()
-    return result
+    try:
+        page = lobbies.getPage(cursor, limit)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+    return Response(content=page, media_type="application/json", headers={"ETag": etag})
+
+#
+#   The public lobbies as a stream of server-sent events: a snapshot of every lobby, then
+#   add and remove events as lobbies open, change or fill up. The events are encoded once
+#   and shared by all the subscribers.
+#
+
+@app.get("/api/v1/games/public/stream")
+async def stream_public_games():
+    snapshot, queue = lobbies.subscribe()
+
+    async def events():
+        try:
+            yield snapshot
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=config.lobby_stream_keepalive)
+                except asyncio.TimeoutError:
+                    # a comment, so proxies don't close an idle stream
+                    yield b": keepalive\n\n"
+                    continue
+
+                if event is None:
+                    return
+                yield event
+        finally:
+            lobbies.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 #
 #   Creates a game and returns the created game ID and the join code
@@ -113,82 +222,89 @@ async def get_public_games():
 #
 class CreateGame(BaseModel):
     player1_name: str
- 
-@app.post("/api/v1/game/create")
-async def create_game(request: CreateGame):
-    if len(request.player1_name) < 3 or len(request.player1_name) > 16:
+
+def validate_player_name(name: str) -> None:
+    if len(name) < 3 or len(name) > 16:
         raise HTTPException(status_code=400, detail="Player name should be between 3 and 16 characters long.")
- 
+
     pattern = r"^[a-zA-Z0-9_.]+$"
-    if not re.match(pattern, request.player1_name):
+    if not re.match(pattern, name):
         raise HTTPException(status_code=400, detail="Player name should contain only letters, number and special characters ('.' and '_')")
- 
-    session = db.getSession()
- 
-    code = generate_game_code()
-    game = Game(
-        code=code,
-        player1_name=request.player1_name,
-        player1_score=0,
-        game_state="waiting",
-        current_round=0,
-        current_round_id=None,
-        created_at=datetime.datetime.now(datetime.timezone.utc)
-    )
- 
-    session.add(game)
-    session.commit()
-    session.refresh(game)
 
-    asyncio.create_task(start_lobby_expire_timer(game.id))
-    return {"game_id": game.id, "code": game.code, "role": "player1", "token": game.player1_token}
+async def store_new_game(game) -> None:
+    # join codes are unique among the games still in use, a collision just means drawing another one
+    for attempt in range(5):
+        try:
+            await registry.create(game)
+            return
+        except IntegrityError:
+            game.code = generate_game_code()
+    raise HTTPException(status_code=500, detail="Could not generate a join code, try again.")
  
-async def start_lobby_expire_timer(game_id: int):
+@app.post("/api/v1/game/create")
+async def create_game(request: CreateGame):
+    validate_player_name(request.player1_name)
+
+    game = registry.LiveGame(generate_game_code(), request.player1_name)
+    await store_new_game(game)
+
     expire_time = 600
     if config.debug:
         expire_time = 60
-    
-    await asyncio.sleep(expire_time)
 
-    session = db.getSession()
-    game = session.query(Game).filter(Game.id == game_id).first()
+    scheduler.schedule(game.id, "lobby", expire_time)
+    return {"game_id": game.id, "code": game.code, "role": "player1", "token": game.player1_token}
+
+#
+#   Starts a game between two players paired by matchmaking. It is created already
+#   active, and its first round is stored with it
+#
+
+async def start_matched_game(player1_name: str, player2_name: str):
+    game = registry.LiveGame(generate_game_code(), player1_name)
+    game.player2_name = player2_name
+    game.player2_score = 0
+    game.game_state = "active"
+    game.current_round = 1
+    game.addRound(1)
+
+    await store_new_game(game)
+
+    scheduler.schedule(game.id, "round", ROUND_TIME, 1)
+    return game
+ 
+async def expire_lobby(game_id: str, payload: int = None):
+    game = await registry.getGame(game_id)
 
     if not game:
-        session.close()
         return
 
     if game.current_round >= 1 or game.game_state != "waiting":
         return
-    
-    session.query(Game).filter(Game.id == game_id).delete()
+
+    registry.remove(game)
+    scheduler.cancel(game.id)
     if config.debug:
         print(f"[LOGS]: Destroyed lobby {game_id} due to inactivity.")
 
-    session.commit()
-
-    session.close()
-
 #
 #   Modifies the public lobby status
 #
 @app.post("/api/v1/game/{game_id}/change_visibility")
 async def get_game(game_id: str, Authorization: str = Header(None)):
-    session = db.getSession()
-    game = session.query(Game).options(joinedload(Game.rounds)).filter(Game.id == game_id).first()
- 
+    game = await registry.getGame(game_id)
+
     if not game:
         raise HTTPException(status_code=404, detail="Game not found.")
- 
+
     token = Authorization.split(" ")[1] if Authorization else None
- 
+
     if token not in [game.player1_token, game.player2_token]:
         raise HTTPException(status_code=403, detail="Invalid token.")
- 
+
     game.public_lobby = not game.public_lobby
+    registry.save(game)
 
-    session.commit()
-    session.refresh(game)
- 
     return {
         "message": "Succesfully updated the game status"
     }
@@ -196,83 +312,118 @@ async def get_game(game_id: str, Authorization: str = Header(None)):
 #
 #   Gets data for a specific game by their ID
 #
- 
-@app.get("/api/v1/game/{game_id}")
-async def get_game(game_id: str, Authorization: str = Header(None)):
-    session = db.getSession()
-    game = session.query(Game).options(joinedload(Game.rounds)).filter(Game.id == game_id).first()
- 
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found.")
- 
-    token = Authorization.split(" ")[1] if Authorization else None
- 
-    if token not in [game.player1_token, game.player2_token]:
-        raise HTTPException(status_code=403, detail="Invalid token.")
- 
-    serialized_game = {
+
+def serialize_round(round) -> dict:
+    return {
+        "round_number": round.round_number,
+        "player1_choice": round.player1_choice,
+        "player2_choice": round.player2_choice,
+        "player1_score": round.player1_score,
+        "player2_score": round.player2_score,
+        "created_at": round.created_at,
+    }
+
+def as_utc(moment: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+    # SQLite gives the stored datetimes back naive, they are UTC like the live game's
+    if moment is None or moment.tzinfo:
+        return moment
+    return moment.replace(tzinfo=datetime.timezone.utc)
+
+# the one shape of a game in responses, from a live game or a row, with or without its rounds
+def serialize_game(game, include_rounds: bool = True) -> dict:
+    rounds = packing.getRounds(game) if include_rounds else None
+    result = {
         "id": game.id,
         "code": game.code,
         "player1_name": game.player1_name,
         "player2_name": game.player2_name,
         "player1_score": game.player1_score,
         "player2_score": game.player2_score,
-        "player1_disconnected_at": game.player1_disconnected_at,
-        "player2_disconnected_at": game.player2_disconnected_at,
-        "current_round": len(game.rounds),
+        "player1_disconnected_at": as_utc(game.player1_disconnected_at),
+        "player2_disconnected_at": as_utc(game.player2_disconnected_at),
+        "current_round": len(rounds) if include_rounds else game.current_round,
         "game_state": game.game_state,
-        "created_at": game.created_at,
-        "finished_at": game.finished_at,
-        "rounds": [
-            {
-                "round_number": r.round_number,
-                "player1_choice": r.player1_choice,
-                "player2_choice": r.player2_choice,
-                "player1_score": r.player1_score,
-                "player2_score": r.player2_score,
-                "created_at": r.created_at,
-            }
-            for r in game.rounds
-        ]
+        "public_lobby": bool(game.public_lobby),
+        "created_at": as_utc(game.created_at),
+        "finished_at": as_utc(game.finished_at),
+        "seq": game.event_seq,
     }
- 
-    return serialized_game
- 
+    if include_rounds:
+        result["rounds"] = [serialize_round(r) for r in rounds]
+    return result
+
+def encode_game(game) -> bytes:
+    return serialization.dumps(serialize_game(game))
+
+@app.get("/api/v1/game/{game_id}", response_model=GameResponse)
+async def get_game(game_id: str, Authorization: str = Header(None)):
+    game = await registry.getGame(game_id)
+
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found.")
+
+    token = Authorization.split(" ")[1] if Authorization else None
+
+    if token not in [game.player1_token, game.player2_token]:
+        raise HTTPException(status_code=403, detail="Invalid token.")
+
+    return Response(content=game.getSnapshot(encode_game), media_type="application/json")
+
+#
+#   Returns the events broadcast for a game after the given sequence number, for clients that
+#   noticed a gap. If they are no longer kept, the whole game is returned instead.
+#
+
+@app.get("/api/v1/game/{game_id}/events", response_model=GameEvents)
+async def get_game_events(game_id: str, since: int = 0, Authorization: str = Header(None)):
+    game = await registry.getGame(game_id)
+
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found.")
+
+    token = Authorization.split(" ")[1] if Authorization else None
+
+    if token not in [game.player1_token, game.player2_token]:
+        raise HTTPException(status_code=403, detail="Invalid token.")
+
+    events = game.getEventsSince(since)
+    if events is None:
+        # the cached snapshot is spliced in as it is
+        content = b'{"seq":%d,"snapshot":%s}' % (game.event_seq, game.getSnapshot(encode_game))
+    else:
+        content = serialization.dumps({"seq": game.event_seq, "events": events})
+
+    return Response(content=content, media_type="application/json")
+
 #
 #   The method that allows the second player to join a lobby
 #   Requires the join code and a player name. Players will rejoin using this method.
 #
- 
+
 class JoinGame(BaseModel):
     code: str
     player_name: str
- 
+
 @app.post("/api/v1/game/join")
 async def join_game(request: JoinGame):
-    if len(request.player_name) < 3 or len(request.player_name) > 16:
-        raise HTTPException(status_code=400, detail="Player name should be between 3 and 16 characters long.")
- 
-    pattern = r"^[a-zA-Z0-9_.]+$"
-    if not re.match(pattern, request.player_name):
-        raise HTTPException(status_code=400, detail="Player name should contain only letters, number and special characters ('.' and '_')")
- 
-    session = db.getSession()
-    game = session.query(Game).filter(Game.code == request.code).first()
+    validate_player_name(request.player_name)
+
+    game = await registry.getGameByCode(request.code)
     if not game:
         raise HTTPException(status_code = 404, detail = "Game not found!")
- 
+
     if game.game_state == "finished" or game.game_state == "abandoned":
         raise HTTPException(status_code=403, detail="Game already finished!")
 
     if game.player1_name == request.player_name or game.player2_name == request.player_name:
             raise HTTPException(status_code=403, detail="There is already a player with that name playing right now!")
- 
+
     if game.game_state == "active" and game.player1_name and game.player2_name:
         raise HTTPException(status_code=403, detail="Both players are active.")
- 
+
     role = None
     token = None
- 
+
     if not game.player1_name:
         game.player1_name = request.player_name
         game.player1_score = game.player1_score if game.player1_score else 0
@@ -287,42 +438,34 @@ async def join_game(request: JoinGame):
         token = game.player2_token
     else:
         raise HTTPException(status_code=400, detail="No available slot for the player.")
- 
+
     if game.player1_name and game.player2_name:
         game.game_state = "active"
         game.current_round = 1 if not game.current_round else game.current_round
+        scheduler.cancel(game.id, "lobby")
+
+    round_started = False
+    if game.player1_name and game.player2_name and game.current_round:
+        if not game.getRound(game.current_round):
+            game.addRound(game.current_round)
+        round_started = True
+
+    registry.save(game)
 
-    session.commit() # Commits the changes to the database
-    session.refresh(game) # Updates the game
- 
     await notify_game_status(
         game_id=game.id,
-        status_update={
-            "message": f"{request.player_name} joined the game", 
+        status_update=game.addEvent("player_joined", {
+            "message": f"{request.player_name} joined the game",
             "game_state": game.game_state,
             "current_round": game.current_round,
             "player1_name": game.player1_name,
             "player2_name": game.player2_name
-        }
+        })
     )
- 
-    if game.player1_name and game.player2_name and game.current_round:
-        existing_round = next((r for r in game.rounds if r.round_number == game.current_round), None)
-        if not existing_round:
-            round = Round(
-                game_id=game.id,
-                round_number=game.current_round,
-                player1_choice=None,
-                player2_choice=None,
-                player1_score=0,
-                player2_score=0
-            )
-            game.rounds.append(round)
-            session.add(round)
-            session.commit()
-            session.refresh(round)
-        asyncio.create_task(start_round_timer(game.id, game.current_round))
- 
+
+    if round_started:
+        scheduler.schedule(game.id, "round", ROUND_TIME, game.current_round)
+
     return {
         "game_id": game.id,
         "player1_name": game.player1_name,
@@ -333,191 +476,136 @@ async def join_game(request: JoinGame):
         "role": role,
         "token": token,
     }
- 
+
 class ChooseColor(BaseModel):
     game_id: str
     round_number: int
     player_name: str
-    choice: str 
+    choice: str
     token: str
 
 @app.post("/api/v1/game/{game_id}/round/{round_number}/choice")
 async def choose_color(request: ChooseColor):
-    session = db.getSession()
-    game = session.query(Game).filter(Game.id == request.game_id).first()
- 
+    game = await registry.getGame(request.game_id)
+
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
- 
+
     if game.game_state != "active":
         raise HTTPException(status_code=403, detail="The game is not active")
- 
+
     if request.choice not in ["RED", "BLUE"]:
         raise HTTPException(status_code=400, detail="Invalid choice")
- 
+
     if request.player_name == game.player1_name and request.token != game.player1_token:
         raise HTTPException(status_code=403, detail="Invalid token for player1.")
     elif request.player_name == game.player2_name and request.token != game.player2_token:
         raise HTTPException(status_code=403, detail="Invalid token for player2.")
     elif request.player_name not in [game.player1_name, game.player2_name]:
         raise HTTPException(status_code=400, detail="Player name does not match")
- 
-    round = next((r for r in game.rounds if r.round_number == request.round_number), None)
- 
-    if not round:
-        round = Round(
-            game_id=game.id,
-            round_number=request.round_number,
-            player1_choice=None,
-            player2_choice=None,
-            player1_score=0,
-            player2_score=0,
-        )
-        game.rounds.append(round)
-        session.add(round)
-        session.commit()
- 
-    if request.player_name == game.player1_name:
-        if round.player1_choice:
+
+    round = game.getRound(request.round_number)
+
+    if round:
+        if request.player_name == game.player1_name and round.player1_choice:
             raise HTTPException(status_code=400, detail="Already chose a color")
-        round.player1_choice = request.choice
- 
-    elif request.player_name == game.player2_name:
-        if round.player2_choice:
+        if request.player_name == game.player2_name and round.player2_choice:
             raise HTTPException(status_code=400, detail="Already chose a color")
-        round.player2_choice = request.choice
- 
     else:
-        raise HTTPException(status_code=400, detail="Player name does not match")
- 
-    session.commit()
-    session.refresh(game)
- 
+        round = game.addRound(request.round_number)
+
+    if request.player_name == game.player1_name:
+        round.player1_choice = request.choice
+    else:
+        round.player2_choice = request.choice
+
+    registry.save(game)
+
     if round.player1_choice and round.player2_choice:
-        multiplier = 2 if round.round_number >= 9 else 1
-        if round.player1_choice == "RED" and round.player2_choice == "RED":
-            round.player1_score += 3 * multiplier
-            round.player2_score += 3 * multiplier
-        elif round.player1_choice == "BLUE" and round.player2_choice == "RED":
-            round.player1_score += 6 * multiplier
-            round.player2_score -= 6 * multiplier
-        elif round.player1_choice == "RED" and round.player2_choice == "BLUE":
-            round.player1_score -= 6 * multiplier
-            round.player2_score += 6 * multiplier
-        elif round.player1_choice == "BLUE" and round.player2_choice == "BLUE":
-            round.player1_score -= 3 * multiplier
-            round.player2_score -= 3 * multiplier
- 
+        player1_points, player2_points = rules.scoreRound(round.player1_choice, round.player2_choice, round.round_number)
+        round.player1_score += player1_points
+        round.player2_score += player2_points
+
         game.player1_score += round.player1_score
         game.player2_score += round.player2_score
         game.current_round = round.round_number
- 
-        session.commit()
-        session.refresh(round)
-        session.refresh(game)
- 
-        if round.round_number < 10:
-            next_round = Round(
-                game_id=game.id,
-                round_number=round.round_number + 1,
-                player1_choice=None,
-                player2_choice=None,
-                player1_score=0,
-                player2_score=0
-            )
- 
-            game.rounds.append(next_round)
+
+        if not rules.isLastRound(round.round_number):
+            next_round = game.addRound(round.round_number + 1)
             game.current_round = round.round_number + 1
- 
-            session.add(next_round)
-            session.commit()
-            session.refresh(next_round)
- 
-            asyncio.create_task(start_round_timer(game.id, next_round.round_number))
- 
+
+            # replaces the timer of the round that just ended
+            scheduler.schedule(game.id, "round", ROUND_TIME, next_round.round_number)
+
+            # only the result of the round that ended, clients already hold the earlier ones
             await notify_game_status(
                 game_id=game.id,
-                status_update={
+                status_update=game.addEvent("round_completed", {
                     "message": f"Round {round.round_number} completed. Next round started!",
- 
+
                     "player1_choice": round.player1_choice,
                     "player2_choice": round.player2_choice,
                     "player1_score": game.player1_score,
                     "player2_score": game.player2_score,
- 
+
                     "next_round": next_round.round_number,
-                    "rounds": [
-                        {
-                            "round_number": r.round_number,
-                            "player1_choice": r.player1_choice,
-                            "player2_choice": r.player2_choice,
-                            "player1_score": r.player1_score,
-                            "player2_score": r.player2_score,
-                            "created_at": r.created_at,
-                        }
-                        for r in game.rounds
-                    ]
-                }
+                    "round": serialize_round(round)
+                })
             )
         else:
             game.game_state = "finished"
             game.finished_at = datetime.datetime.now(datetime.timezone.utc)
-            session.commit()
-            session.refresh(game)
- 
+            registry.save(game)
+            scheduler.cancel(game.id)
+
             await notify_game_status(
                 game_id=game.id,
-                status_update={
+                status_update=game.addEvent("game_finished", {
                     "message": "Game over! All 10 rounds completed.",
- 
+
                     "player1_choice": round.player1_choice,
                     "player2_choice": round.player2_choice,
                     "player1_score": game.player1_score,
                     "player2_score": game.player2_score,
- 
-                    "game_state": game.game_state
-                }
+
+                    "game_state": game.game_state,
+                    "round": serialize_round(round)
+                })
             )
- 
+
     return {"message": "Choice registered successfully"}
 
-async def start_round_timer(game_id: int, round_number: int):
-    await asyncio.sleep(60)
- 
-    session = db.getSession()
-    game = session.query(Game).filter(Game.id == game_id, Game.game_state == "active").first()
- 
-    if not game:
-        session.close()
+async def expire_round(game_id: str, round_number: int):
+    game = await registry.getGame(game_id)
+
+    if not game or game.game_state != "active":
         return
- 
-    round = next((r for r in game.rounds if r.round_number == round_number), None)
+
+    round = game.getRound(round_number)
     if not round:
-        session.close()
         return
- 
+
     if not round.player1_choice and not round.player2_choice:
         game.game_state = "finished"
- 
+
         game.player1_score = 0
         game.player2_score = 0
- 
-        session.commit()
-        session.refresh(game)
- 
+
+        registry.save(game)
+        scheduler.cancel(game.id)
+
         await notify_game_status(
             game_id=game.id,
-            status_update={
+            status_update=game.addEvent("game_timed_out", {
                 "message": f"Game ended: no choices made by either player in round {round_number}.",
                 "game_state": game.game_state,
                 "player1_score": game.player1_score,
                 "player2_score": game.player2_score
-            }
+            })
         )
- 
-        session.close()
+
         return
- 
+
     if round.player1_choice and not round.player2_choice:
         abandoning_player = game.player2_name
         token = game.player2_token
@@ -525,153 +613,132 @@ async def start_round_timer(game_id: int, round_number: int):
         abandoning_player = game.player1_name
         token = game.player1_token
     else:
-        session.close()
         return
- 
+
     fake_request = AbandonGame(
         game_id=game.id,
         player_name=abandoning_player,
         token=token
     )
     await abandon_game(fake_request)
- 
-    session.close()
- 
- 
+
+
 #
 #   In case one player abandons the game, their score will be set to 0
 #   while the opponents will be set to 1, and the game is set to finished.
 #
- 
+
 class AbandonGame(BaseModel):
     game_id: str
     player_name: str
     token: str
- 
+
 @app.post("/api/v1/game/{game_id}/abandon")
 async def abandon_game(request: AbandonGame):
- 
-    session = db.getSession()
-    game = session.query(Game).filter(Game.id == request.game_id).first()
- 
+
+    game = await registry.getGame(request.game_id)
+
     if not game:
         raise HTTPException(status_code = 404, detail = "Game not found!")
- 
+
     if game.game_state != "active":
         raise HTTPException(status_code = 403, detail = "The game is not active!")
- 
+
     if request.player_name == game.player1_name and request.token != game.player1_token:
         raise HTTPException(status_code=403, detail="Invalid token for player1.")
     elif request.player_name == game.player2_name and request.token != game.player2_token:
         raise HTTPException(status_code=403, detail="Invalid token for player2.")
- 
-    round_diff = 10 - game.current_round
- 
-    for i in range(0, round_diff):
-        multiplier = 2 if game.current_round >= 8 else 1
- 
-        game.current_round += 1
- 
-        next_round = Round(
-                game_id=game.id,
-                round_number=game.current_round,
-                player1_choice=None,
-                player2_choice=None,
-                player1_score = (-6 * multiplier) if game.player1_name == request.player_name else 6 * multiplier,
-                player2_score = (-6 * multiplier) if game.player2_name == request.player_name else 6 * multiplier,
-            )        
- 
-        session.add(next_round)
-        game.rounds.append(next_round)
- 
-        game.player1_score = game.player1_score + ((-6 * multiplier) if game.player1_name == request.player_name else 6 * multiplier)
-        game.player2_score = game.player2_score + ((-6 * multiplier) if game.player2_name == request.player_name else 6 * multiplier)
- 
-        session.commit()
-        session.refresh(game)
-        session.refresh(next_round)
- 
-    game.player1_score = game.player1_score + ((-24) if game.player1_name == request.player_name else 0)
-    game.player2_score = game.player2_score + ((-24) if game.player2_name == request.player_name else 0)
- 
+    elif request.player_name not in [game.player1_name, game.player2_name]:
+        raise HTTPException(status_code=400, detail="Player name does not match")
+
+    abandoned_by = 1 if request.player_name == game.player1_name else 2
+
+    # the whole outcome is worked out first and lands in the registry at once, so it is stored in one flush
+    for round_number, player1_points, player2_points in rules.forfeitRounds(game.current_round, abandoned_by):
+        game.addRound(round_number, player1_score=player1_points, player2_score=player2_points)
+        game.player1_score += player1_points
+        game.player2_score += player2_points
+        game.current_round = round_number
+
+    player1_penalty, player2_penalty = rules.abandonPenalty(abandoned_by)
+    game.player1_score += player1_penalty
+    game.player2_score += player2_penalty
+
     game.game_state = "abandoned"
- 
-    session.commit()
-    session.refresh(game)
- 
+
+    registry.save(game)
+    scheduler.cancel(game.id)
+
     await notify_game_status(
         game_id=game.id,
-        status_update={
+        status_update=game.addEvent("player_abandoned", {
             "message": f"{request.player_name} abandoned the game.",
             "game_state": game.game_state,
             "player1_score": game.player1_score,
             "player2_score": game.player2_score,
-        }
+        })
     )
- 
+
     return {
         "response": f"{request.player_name} abandoned the game!",
         "game_state" : game.game_state,
     }
- 
+
 #
 #   Deletes a game by its ID if its in "waiting" state
 #
- 
+
 @app.delete("/api/v1/game/{game_id}/delete")
 async def delete_game(game_id: str, Authorization: str = Header(None)):
-    session = db.getSession()
-    game = session.query(Game).filter(Game.id == game_id).first()
- 
+    game = await registry.getGame(game_id)
+
     if not game:
         raise HTTPException(status_code=404, detail="Game not found.")
- 
+
     if game.game_state != "waiting":
         raise HTTPException(status_code=403, detail="Game cannot be deleted. It is already in progress.")
- 
+
     token = Authorization.split(" ")[1] if Authorization else None
- 
+
     if token not in [game.player1_token, game.player2_token]:
         raise HTTPException(status_code=403, detail="Invalid token.")
- 
- 
-    session.delete(game)
-    session.commit()
-    session.close()
- 
+
+
+    registry.remove(game)
+    scheduler.cancel(game.id)
+
     if config.debug:
         print(f"[LOGS]: Destroyed lobby {game_id} by request.")
- 
+
     return {"message": "Game deleted successfully."}
 
 
 #
 #   The API method used for players that disconnect from the game
 #
- 
+
 class DisconnectGame(BaseModel):
     game_id: str
     player_name: str
     token: str
- 
+
 @app.post("/api/v1/game/{game_id}/disconnect")
 async def disconnect_game(request: DisconnectGame):
     print(f"Starting: [disconnect event on game: {request.game_id}, player_name: {request.player_name}]")
 
-    session = db.getSession()
-    game = session.query(Game).filter(Game.id == request.game_id).first()
+    game = await registry.getGame(request.game_id)
 
     if not game:
         raise HTTPException(status_code = 404, detail = "Game not found!")
 
     if game.game_state == "waiting" or game.game_state == "finished" or game.game_state == "abandoned":
         raise HTTPException(status_code = 403, detail = "The game is not active!")
-    
+
     if request.player_name == game.player1_name and game.player1_disconnected_at:
         raise HTTPException(status_code = 403, detail = "Player1 already disconnected!")
     if request.player_name == game.player2_name and game.player2_disconnected_at:
         raise HTTPException(status_code = 403, detail = "Player2 already disconnected!")
-    
+
     if request.player_name == game.player1_name and request.token != game.player1_token:
         raise HTTPException(status_code=403, detail="Invalid token for player1.")
     elif request.player_name == game.player2_name and request.token != game.player2_token:
@@ -682,31 +749,33 @@ async def disconnect_game(request: DisconnectGame):
     if game.rounds:
         last_round = sorted(game.rounds, key=lambda r: r.round_number)[-1]
         if not (last_round.player1_choice and last_round.player2_choice):
-            session.delete(last_round)
-            game.rounds.remove(last_round)
+            game.removeRound(last_round)
+
+    previous_state = game.game_state
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    game.game_state = "pause" if game.player1_name or game.player2_name else "finished"
+    if request.player_name == game.player1_name:
+        game.player1_name = None
+        game.player1_disconnected_at = now
+    if request.player_name == game.player2_name:
+        game.player2_name = None
+        game.player2_disconnected_at = now
+
+    registry.save(game)
+
+    # the round starts over once the player is back
+    scheduler.cancel(game.id, "round")
+    scheduler.schedule(game.id, "disconnect", DISCONNECT_TIME + 10)
 
     await notify_game_status(
         game_id=game.id,
-        status_update={
+        status_update=game.addEvent("player_disconnected", {
             "message": f"{request.player_name} left the game. Waiting for him to join back...",
-            "game_state": game.game_state,
-        }
+            "game_state": previous_state,
+        })
     )
 
-    session.query(Game).filter(Game.id == request.game_id).update({
-        "player1_name": None if request.player_name == game.player1_name else game.player1_name,
-        "player2_name": None if request.player_name == game.player2_name else game.player2_name,
-        "player1_disconnected_at": datetime.datetime.now(datetime.timezone.utc) if request.player_name == game.player1_name else game.player1_disconnected_at,
-        "player2_disconnected_at": datetime.datetime.now(datetime.timezone.utc) if request.player_name == game.player2_name else game.player2_disconnected_at,
-        "game_state": "pause" if game.player1_name or game.player2_name else "finished",
-        "current_round": game.current_round,
-    })
-
-    session.commit() # Commits the changes to the database
-    session.refresh(game) # Updates the game
-
-    asyncio.create_task(check_disconnection_timer(game.id))
-
     print(f"Ending: [disconnect event on game: {request.game_id}]")
 
     return {
@@ -714,22 +783,15 @@ async def disconnect_game(request: DisconnectGame):
         "game_state": game.game_state,
     }
 
-async def check_disconnection_timer(game_id: str):
-    time = 600
-    if config.debug:
-        time = 60
+async def expire_disconnection(game_id: str, payload: int = None):
+    time = DISCONNECT_TIME
 
-    await asyncio.sleep(time + 10)
-
-    session = db.getSession()
-    game = session.query(Game).filter(Game.id == game_id).first()
+    game = await registry.getGame(game_id)
 
     if not game:
-        session.close()
         return
 
     if game.game_state != "pause":
-        session.close()
         return
 
     now = datetime.datetime.now(datetime.timezone.utc)
@@ -738,21 +800,16 @@ async def check_disconnection_timer(game_id: str):
         if player1_disconnected_at.tzinfo is None:
             player1_disconnected_at = player1_disconnected_at.replace(tzinfo=datetime.timezone.utc)
         if (now - player1_disconnected_at).total_seconds() > time:
+            registry.remove(game)
+            scheduler.cancel(game.id)
+
             await notify_game_status(
                 game_id=game.id,
-                status_update={
+                status_update=game.addEvent("game_deleted", {
                     "message": f"{game.player1_name} has been disconnected for more than 10 minutes. Game will be deleted.",
                     "game_state": "finished",
-                }
+                })
             )
-            
-            for r in list(game.rounds):
-                session.delete(r)
-
-            session.delete(game)
-            
-            session.commit()
-            session.close()
             return
 
     if game.player2_disconnected_at:
@@ -760,18 +817,20 @@ async def check_disconnection_timer(game_id: str):
         if player2_disconnected_at.tzinfo is None:
             player2_disconnected_at = player2_disconnected_at.replace(tzinfo=datetime.timezone.utc)
         if (now - player2_disconnected_at).total_seconds() > time:
+            registry.remove(game)
+            scheduler.cancel(game.id)
+
             await notify_game_status(
                 game_id=game.id,
-                status_update={
+                status_update=game.addEvent("game_deleted", {
                     "message": f"{game.player2_name} has been disconnected for more than 10 minutes. Game will be deleted.",
                     "game_state": "finished",
-                }
+                })
             )
-            
-            for r in list(game.rounds):
-                session.delete(r)
-
-            session.delete(game)
-            session.commit()
-            session.close()
-            return
\ No newline at end of file
+            return
+
+archive.register(serialize_game)
+
+scheduler.register("lobby", expire_lobby)
+scheduler.register("round", expire_round)
+scheduler.register("disconnect", expire_disconnection)
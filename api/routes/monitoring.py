@@ -0,0 +1,51 @@
+from fastapi import Response
+
+from api.app import getApp
+from core import lobbies
+from core import matchmaking
+from core import metrics
+from core import registry
+from core import scheduler
+from database import session as db
+from database import writer
+from ws import wsManager
+
+app = getApp()
+
+#
+#   Metrics of the server in the Prometheus text format, meant to be scraped.
+#   The gauges are read from the live state at scrape time.
+#
+
+@app.get("/metrics")
+async def get_metrics():
+    timers = scheduler.getStats()
+    sockets = wsManager.getStats()
+    pool = db.getPoolStats()
+    writes = writer.getStats()
+
+    gauges = [
+        ("redblue_games_live", "gauge", "Games held in memory by the registry.", len(registry.games)),
+        ("redblue_games_unsaved", "gauge", "Live games with changes not written to the database yet.", len(registry.dirty)),
+        ("redblue_websocket_games", "gauge", "Games with at least one connected socket.", sockets["games"]),
+        ("redblue_websocket_connections", "gauge", "Connected websockets.", sockets["connections"]),
+        ("redblue_websocket_queued_messages", "gauge", "Messages waiting in the socket queues.", sockets["queued_messages"]),
+        ("redblue_websocket_dropped_total", "counter", "Sockets dropped for being slow, dead or idle.", sockets["dropped_slow"] + sockets["dropped_dead"] + sockets["dropped_idle"]),
+        ("redblue_websocket_relayed_total", "counter", "Client frames relayed to the other sockets of their game.", sockets["relayed"]),
+        ("redblue_websocket_coalesced_total", "counter", "Client frames replaced by a newer one before being relayed.", sockets["coalesced_frames"]),
+        ("redblue_websocket_rejected_total", "counter", "Client frames dropped for being throttled, too long or invalid.", sockets["throttled_frames"] + sockets["oversized_frames"] + sockets["invalid_frames"]),
+        ("redblue_lobby_stream_subscribers", "gauge", "Clients following the public lobby stream.", len(lobbies.subscribers)),
+        ("redblue_matchmaking_waiting", "gauge", "Players waiting in the matchmaking queue.", matchmaking.waiting()),
+        ("redblue_timers_pending", "gauge", "Timers waiting to fire.", timers["pending"]),
+        ("redblue_timers_fired_total", "counter", "Timers fired.", timers["fired"]),
+        ("redblue_timers_failed_total", "counter", "Timers whose handler raised.", timers["failed"]),
+        ("redblue_timers_max_lateness_seconds", "gauge", "Largest delay between a deadline and its timer firing.", timers["max_lateness"]),
+        ("redblue_db_pool_checked_out", "gauge", "Read connections in use.", pool["checked_out"]),
+        ("redblue_db_pool_overflow", "gauge", "Read connections open beyond the pool size.", pool["overflow"]),
+        ("redblue_db_pool_timeouts_total", "counter", "Requests that gave up waiting for a read connection.", pool["timeouts"]),
+        ("redblue_db_writer_queued", "gauge", "Write jobs waiting for the writer.", writes["queued"]),
+        ("redblue_db_writer_commits_total", "counter", "Transactions committed by the writer.", writes["commits"]),
+        ("redblue_db_writer_jobs_total", "counter", "Write jobs run by the writer.", writes["jobs"]),
+    ]
+
+    return Response(content=metrics.render(gauges), media_type="text/plain; version=0.0.4")
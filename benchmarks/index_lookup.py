@@ -0,0 +1,167 @@
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import create_engine
+
+from database import migrations
+from database import session as db
+from misc.functions import generate_game_code
+from models.game_model import ACTIVE_STATES
+
+# imported so their tables are part of the metadata
+from models import game_model, round_model
+
+#
+#   Measures the hot lookups against growing game tables, once with the indexes from
+#   database/migrations.py and once after dropping them.
+#
+#   Run from the repository root: python -m benchmarks.index_lookup --sizes 10000,100000,1000000
+#
+
+INDEXES = ["ux_game_code_active", "ix_game_code", "ix_game_public_lobby", "ix_game_created_at_id", "ix_game_state_created_at", "ux_rounds_game_round"]
+
+STATES = ["finished"] * 90 + ["abandoned"] * 6 + ["waiting"] * 2 + ["active"] * 2
+
+QUERIES = {
+    "join by code": (
+        "SELECT * FROM game WHERE code = ? AND game_state IN ('waiting', 'active', 'pause') LIMIT 1",
+        lambda sample: (random.choice(sample["codes"]),),
+    ),
+    "public lobbies": (
+        "SELECT id, code, player1_name FROM game WHERE public_lobby = 1 AND game_state = 'waiting' ORDER BY created_at DESC LIMIT 50",
+        lambda sample: (),
+    ),
+    "rounds of a game": (
+        "SELECT * FROM rounds WHERE game_id = ?",
+        lambda sample: (random.choice(sample["ids"]),),
+    ),
+    "cleanup batch": (
+        "SELECT id FROM game WHERE created_at < ? LIMIT 500",
+        lambda sample: (sample["cutoff"],),
+    ),
+    "admin deep page": (
+        "SELECT id FROM game WHERE game_state != 'active' AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT 11",
+        lambda sample: (sample["cutoff"], ""),
+    ),
+    "admin deep offset": (
+        "SELECT id FROM game WHERE game_state != 'active' ORDER BY created_at DESC, id DESC LIMIT 11 OFFSET ?",
+        lambda sample: (sample["offset"],),
+    ),
+}
+
+def populate(connection, size: int, rounds_per_game: int) -> dict:
+    start = datetime.datetime(2024, 1, 1)
+    sample = {"codes": [], "ids": []}
+    active_codes = set()
+    batch_games = []
+    batch_rounds = []
+
+    for i in range(size):
+        game_id = str(uuid.uuid4())
+        state = random.choice(STATES)
+        code = generate_game_code()
+        if state in ACTIVE_STATES:
+            while code in active_codes:
+                code = generate_game_code()
+            active_codes.add(code)
+        created_at = (start + datetime.timedelta(seconds=i)).isoformat(" ")
+
+        batch_games.append((
+            game_id, code, "player1", "player2", 0, 0, str(uuid.uuid4()), str(uuid.uuid4()),
+            rounds_per_game, None, state, random.random() < 0.5, created_at,
+        ))
+        for number in range(1, rounds_per_game + 1):
+            batch_rounds.append((str(uuid.uuid4()), game_id, number, "RED", "BLUE", -6, 6, created_at))
+
+        if state in ("waiting", "active") and len(sample["codes"]) < 1000:
+            sample["codes"].append(code)
+        if len(sample["ids"]) < 1000 and random.random() < 0.01:
+            sample["ids"].append(game_id)
+
+        if len(batch_games) >= 50000:
+            insert(connection, batch_games, batch_rounds)
+            batch_games, batch_rounds = [], []
+
+    insert(connection, batch_games, batch_rounds)
+    connection.commit()
+
+    sample["ids"] = sample["ids"] or [game_id]
+    sample["codes"] = sample["codes"] or [code]
+    sample["cutoff"] = (start + datetime.timedelta(seconds=size // 10)).isoformat(" ")
+    sample["offset"] = size - size // 10
+    return sample
+
+def insert(connection, games: list, rounds: list) -> None:
+    connection.executemany(
+        "INSERT INTO game (id, code, player1_name, player2_name, player1_score, player2_score, player1_token, player2_token, "
+        "current_round, current_round_id, game_state, public_lobby, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        games,
+    )
+    connection.executemany(
+        "INSERT INTO rounds (id, game_id, round_number, player1_choice, player2_choice, player1_score, player2_score, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        rounds,
+    )
+
+def measure(connection, sample: dict, repeat: int) -> dict:
+    results = {}
+    for name, (query, params) in QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            arguments = params(sample)
+            started = time.perf_counter()
+            connection.execute(query, arguments).fetchall()
+            timings.append((time.perf_counter() - started) * 1_000_000)
+        results[name] = statistics.median(timings)
+    return results
+
+def run(size: int, rounds_per_game: int, repeat: int, unindexed: bool) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.sqlite")
+        engine = create_engine(f"sqlite:///{path}")
+        with engine.begin() as connection:
+            migrations.upgradeSchema(connection, db.getBase().metadata)
+
+        raw = engine.raw_connection()
+        try:
+            sample = populate(raw.driver_connection, size, rounds_per_game)
+            raw.execute("ANALYZE")
+            raw.commit()
+
+            indexed = measure(raw.driver_connection, sample, repeat)
+
+            if unindexed:
+                for index in INDEXES:
+                    raw.execute(f"DROP INDEX {index}")
+                raw.commit()
+                plain = measure(raw.driver_connection, sample, max(1, repeat // 10))
+        finally:
+            raw.close()
+            engine.dispose()
+
+    for name in QUERIES:
+        line = f"{size:>10} {name:<18} indexed {indexed[name]:>10.1f} us"
+        if unindexed:
+            line += f"   no index {plain[name]:>12.1f} us"
+        print(line)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Lookup latency of the hot game queries as the tables grow.")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated numbers of games")
+    parser.add_argument("--rounds-per-game", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=200, help="lookups per query and size")
+    parser.add_argument("--skip-unindexed", action="store_true", help="only measure the indexed schema")
+    arguments = parser.parse_args()
+
+    random.seed(0)
+    for size in [int(s) for s in arguments.sizes.split(",")]:
+        run(size, arguments.rounds_per_game, arguments.repeat, not arguments.skip_unindexed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from core import config
+
+#
+#   End-to-end load test, fully in process and offline: the app is driven through an ASGI
+#   transport for HTTP and an in-process ASGI client for the websockets, against a fresh
+#   database in a temporary directory. Every simulated game goes create -> join -> 10 rounds,
+#   and ends finished, abandoned, or after a disconnect and a rejoin.
+#
+#   Reports the throughput, p50/p95/p99 latency per endpoint and the websocket delivery latency
+#   (from the request completing a round to the event reaching each player), and saves them as
+#   JSON. Pass --compare with an earlier result to see the difference.
+#
+#   Run from the repository root: python -m benchmarks.load_test --games 200 --concurrency 50
+#
+
+SCENARIOS = ("finish", "abandon", "disconnect")
+CHOICES = ("RED", "BLUE")
+
+class WebSocketClient:
+    # the ASGI side of a websocket connection, the app runs as a task fed through two queues
+    def __init__(self, app, path: str):
+        self.app = app
+        self.path = path
+        self.inbound = asyncio.Queue()
+        self.outbound = asyncio.Queue()
+        self.events = asyncio.Queue()
+        self.task = None
+        self.reader = None
+
+    async def connect(self) -> None:
+        path, _, query = self.path.partition("?")
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": [],
+            "client": ("bench", 0),
+            "server": ("bench", 80),
+            "subprotocols": [],
+        }
+        self.outbound.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(scope, self.outbound.get, self.inbound.put))
+
+        message = await self.inbound.get()
+        if message["type"] != "websocket.accept":
+            raise Exception(f"Websocket {self.path} was not accepted: {message}")
+
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self) -> None:
+        while True:
+            message = await self.inbound.get()
+            if message["type"] == "websocket.close":
+                return
+            if message["type"] == "websocket.send":
+                event = json.loads(message["text"])
+                if event.get("type") == "heartbeat":
+                    # echoed, which opts the socket in to the idle reaping, so the sweep is part of the load
+                    self.outbound.put_nowait({"type": "websocket.receive", "text": message["text"]})
+                    continue
+                self.events.put_nowait((time.perf_counter(), event))
+
+    async def waitFor(self, event_type: str, timeout: float = 30.0):
+        # events of a game arrive in order, the ones before the awaited one are skipped
+        while True:
+            received_at, event = await asyncio.wait_for(self.events.get(), timeout)
+            if event.get("type") == event_type:
+                return received_at, event
+
+    async def close(self) -> None:
+        self.outbound.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self.task, 5)
+        except (asyncio.TimeoutError, Exception):
+            self.task.cancel()
+        self.reader.cancel()
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.delivery: List[float] = []
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+        if response.status_code >= 400:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            raise Exception(f"{name} failed with {response.status_code}: {response.text}")
+        return response
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarize(values: List[float], elapsed: float) -> dict:
+    if not values:
+        return {"count": 0}
+
+    return {
+        "count": len(values),
+        "throughput": len(values) / elapsed,
+        "mean_ms": sum(values) / len(values) * 1000,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": max(values) * 1000,
+    }
+
+async def playRounds(client, recorder: Recorder, game: dict, players: list, sockets: list, first: int, last: int) -> None:
+    for round_number in range(first, last + 1):
+        # the first choice only registers, the second completes the round and is the one timed for delivery
+        for index, (name, token) in enumerate(players):
+            if index == 1:
+                sent_at = time.perf_counter()
+
+            await recorder.call(client, "choice", "POST", f"/api/v1/game/{game['game_id']}/round/{round_number}/choice", json={
+                "game_id": game["game_id"],
+                "round_number": round_number,
+                "player_name": name,
+                "choice": random.choice(CHOICES),
+                "token": token,
+            })
+
+        event_type = "game_finished" if round_number == 10 else "round_completed"
+        for socket in sockets:
+            received_at, _ = await socket.waitFor(event_type)
+            recorder.delivery.append(received_at - sent_at)
+
+async def playGame(app, client, recorder: Recorder, number: int, scenario: str) -> None:
+    response = await recorder.call(client, "create", "POST", "/api/v1/game/create", json={"player1_name": f"host{number}"})
+    game = response.json()
+
+    sockets = [WebSocketClient(app, f"/ws/game/{game['game_id']}") for _ in range(2)]
+    for socket in sockets:
+        await socket.connect()
+
+    try:
+        response = await recorder.call(client, "join", "POST", "/api/v1/game/join", json={"code": game["code"], "player_name": f"guest{number}"})
+        players = [(f"host{number}", game["token"]), (f"guest{number}", response.json()["token"])]
+
+        if scenario == "finish":
+            await playRounds(client, recorder, game, players, sockets, 1, 10)
+
+        elif scenario == "abandon":
+            await playRounds(client, recorder, game, players, sockets, 1, 5)
+            await recorder.call(client, "abandon", "POST", f"/api/v1/game/{game['game_id']}/abandon", json={
+                "game_id": game["game_id"], "player_name": players[1][0], "token": players[1][1],
+            })
+            await sockets[0].waitFor("player_abandoned")
+
+        else:
+            await playRounds(client, recorder, game, players, sockets, 1, 5)
+            await recorder.call(client, "disconnect", "POST", f"/api/v1/game/{game['game_id']}/disconnect", json={
+                "game_id": game["game_id"], "player_name": players[1][0], "token": players[1][1],
+            })
+            await sockets[0].waitFor("player_disconnected")
+
+            response = await recorder.call(client, "join", "POST", "/api/v1/game/join", json={"code": game["code"], "player_name": f"back{number}"})
+            players[1] = (f"back{number}", response.json()["token"])
+            _, event = await sockets[0].waitFor("player_joined")
+
+            await recorder.call(client, "get", "GET", f"/api/v1/game/{game['game_id']}", headers={"Authorization": "Bearer " + game["token"]})
+            await playRounds(client, recorder, game, players, sockets, event["current_round"], 10)
+    finally:
+        for socket in sockets:
+            await socket.close()
+
+def gitRevision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(arguments) -> dict:
+    from api import app as api
+    from api.routes import admin, game
+    from ws import wsManager
+
+    app = api.getApp()
+    scenarios = [SCENARIOS[i % len(SCENARIOS)] if arguments.mix else "finish" for i in range(arguments.games)]
+    recorder = Recorder()
+    failures = []
+    limit = asyncio.Semaphore(arguments.concurrency)
+
+    async def limited(client, number: int, scenario: str) -> None:
+        async with limit:
+            try:
+                await playGame(app, client, recorder, number, scenario)
+            except Exception as e:
+                failures.append(f"game {number} ({scenario}): {e}")
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*[limited(client, number, scenario) for number, scenario in enumerate(scenarios)])
+            elapsed = time.perf_counter() - started
+
+            stats = (await client.get("/api/v1/admin/stats", params={"admin_token": config.admin_token})).json()
+
+    requests = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    return {
+        "revision": gitRevision(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "arguments": vars(arguments),
+        "elapsed_s": elapsed,
+        "games_per_s": (arguments.games - len(failures)) / elapsed,
+        "requests": summarize(requests, elapsed),
+        "endpoints": {name: summarize(latencies, elapsed) for name, latencies in sorted(recorder.latencies.items())},
+        "websocket_delivery": summarize(recorder.delivery, elapsed),
+        "errors": recorder.errors,
+        "failed_games": failures[:20],
+        "server": stats,
+    }
+
+def report(results: dict, previous: Optional[dict]) -> None:
+    print(f"{results['arguments']['games']} games in {results['elapsed_s']:.2f} s, {results['games_per_s']:.1f} games/s, "
+          f"{results['requests']['throughput']:.0f} requests/s, {len(results['failed_games'])} failed")
+
+    rows = dict(results["endpoints"], websocket=results["websocket_delivery"])
+    before = dict(previous["endpoints"], websocket=previous["websocket_delivery"]) if previous else {}
+
+    print(f"{'':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in rows.items():
+        if not row["count"]:
+            continue
+        line = f"{name:<12}{row['count']:>8}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+        if before.get(name, {}).get("count"):
+            line += f"   p95 {row['p95_ms'] - before[name]['p95_ms']:+.2f} ms vs {previous['revision']}"
+        print(line)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="In-process load test of the game API and websockets.")
+    parser.add_argument("--games", type=int, default=200, help="games to play")
+    parser.add_argument("--concurrency", type=int, default=50, help="games played at the same time")
+    parser.add_argument("--finish-only", dest="mix", action="store_false", help="only play games to the end, no abandons or disconnects")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="where to save the results (default benchmarks/results/load-<revision>-<time>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results to compare the latencies with")
+    arguments = parser.parse_args()
+
+    random.seed(arguments.seed)
+    output = os.path.abspath(arguments.output or os.path.join(
+        "benchmarks", "results", f"load-{gitRevision() or 'local'}-{datetime.datetime.now():%Y%m%d-%H%M%S}.json"))
+    previous = None
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            previous = json.load(file)
+
+    # quiet, and on a database of its own
+    config.debug = False
+    directory = tempfile.mkdtemp(prefix="red-blue-load-")
+    config.database_file = os.path.join(directory, "load.sqlite")
+    config.broadcast_backend = "local"
+
+    from database import session as db
+    db.initConnection()
+
+    results = asyncio.run(run(arguments))
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2, default=str)
+
+    report(results, previous)
+    print(f"Saved to {output}")
+
+    if results["failed_games"]:
+        print("\n".join(results["failed_games"][:5]), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+import httpx
+
+from benchmarks.load_test import WebSocketClient, summarize
+from core import config
+
+#
+#   Matchmaking under load, in process like the load test: N players enter the queue over
+#   --spread seconds, spread over --buckets buckets, and each waits on its socket for the
+#   match_found message. Reports the pairing throughput and the time each player waited.
+#
+#   Run from the repository root: python -m benchmarks.matchmaking --players 5000 --spread 2
+#
+
+async def enter(app, number: int, bucket: str, delay: float, waits: List[float], failures: List[str]) -> None:
+    await asyncio.sleep(delay)
+
+    socket = WebSocketClient(app, f"/ws/matchmaking?player_name=player{number}&bucket={bucket}")
+    started = time.perf_counter()
+    try:
+        await socket.connect()
+        received_at, _ = await socket.waitFor("match_found")
+        waits.append(received_at - started)
+    except Exception as e:
+        failures.append(f"player {number}: {e!r}")
+    finally:
+        await socket.close()
+
+async def run(arguments) -> dict:
+    from api import app as api
+    from api.routes import admin, game
+    from ws import matchmaking, wsManager
+
+    app = api.getApp()
+    waits: List[float] = []
+    failures: List[str] = []
+
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            enter(app, number, f"b{number % arguments.buckets}", random.uniform(0, arguments.spread), waits, failures)
+            for number in range(arguments.players)
+        ])
+        elapsed = time.perf_counter() - started
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            stats = (await client.get("/api/v1/admin/stats", params={"admin_token": config.admin_token})).json()
+
+    return {
+        "arguments": vars(arguments),
+        "elapsed_s": elapsed,
+        "games_per_s": len(waits) / 2 / elapsed,
+        "wait": summarize(waits, elapsed),
+        "failed_players": failures[:20],
+        "server": stats["matchmaking"],
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="In-process benchmark of the matchmaking queue.")
+    parser.add_argument("--players", type=int, default=2000, help="players entering the queue, an even number so everyone is paired")
+    parser.add_argument("--spread", type=float, default=1.0, help="seconds over which the players arrive")
+    parser.add_argument("--buckets", type=int, default=1, help="matchmaking buckets the players are split between")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    random.seed(arguments.seed)
+
+    config.debug = False
+    directory = tempfile.mkdtemp(prefix="red-blue-matchmaking-")
+    config.database_file = os.path.join(directory, "matchmaking.sqlite")
+    config.broadcast_backend = "local"
+
+    from database import session as db
+    db.initConnection()
+
+    results = asyncio.run(run(arguments))
+
+    wait = results["wait"]
+    print(f"{arguments.players} players in {results['elapsed_s']:.2f} s, {results['games_per_s']:.1f} games/s, "
+          f"{len(results['failed_players'])} failed")
+    if wait["count"]:
+        print(f"wait p50 {wait['p50_ms']:.2f} ms, p95 {wait['p95_ms']:.2f} ms, p99 {wait['p99_ms']:.2f} ms, max {wait['max_ms']:.2f} ms")
+    print(f"server: {results['server']}")
+
+if __name__ == "__main__":
+    main()
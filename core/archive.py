@@ -0,0 +1,147 @@
+import asyncio
+import mmap
+import os
+import re
+import struct
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from core import config
+from core import serialization
+from database import session as db
+from models.game_model import Game
+
+#
+#   Cold storage for the games past their retention age. Instead of being deleted, they are
+#   appended to segment files as zlib-compressed JSON records, in the shape the API returns.
+#   Each segment has a sidecar index of fixed-width entries (game id, offset, length), written
+#   after the records it points to, so an entry never refers to data that isn't there. Segments
+#   are never rewritten; once one reaches archive_segment_size the next one is started.
+#
+#   Reads go through read-only memory maps of the segments, and the in-memory index is built
+#   from the sidecars, picking up the entries appended since it was last read.
+#
+
+ENTRY = struct.Struct("<36sQI")
+SEGMENT_NAME = re.compile(r"^segment-(\d{6})\.idx$")
+
+# game id -> (segment, offset, length)
+index: Dict[str, Tuple[int, int, int]] = {}
+
+# bytes of each sidecar already read into the index
+positions: Dict[int, int] = {}
+
+maps: Dict[int, mmap.mmap] = {}
+
+# encodes a game row as it is archived, registered by the game routes
+encoder: Optional[Callable] = None
+
+# one append at a time, records of two batches must not interleave in a segment
+appending = asyncio.Lock()
+
+stats = {
+    "archived": 0,
+    "bytes": 0,
+    "reads": 0,
+}
+
+def register(encode: Callable) -> None:
+    global encoder
+    encoder = encode
+
+def getDirectory() -> str:
+    directory = os.path.abspath(config.archive_directory)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def segmentPath(segment: int, extension: str) -> str:
+    return os.path.join(getDirectory(), f"segment-{segment:06d}.{extension}")
+
+def getSegments() -> List[int]:
+    return sorted(int(match.group(1)) for match in map(SEGMENT_NAME.match, os.listdir(getDirectory())) if match)
+
+def refresh() -> None:
+    for segment in getSegments():
+        position = positions.get(segment, 0)
+        with open(segmentPath(segment, "idx"), "rb") as file:
+            file.seek(position)
+            data = file.read()
+
+        # a half-written entry at the end is read once it is complete
+        complete = len(data) - len(data) % ENTRY.size
+        for game_id, offset, length in ENTRY.iter_unpack(data[:complete]):
+            index[game_id.decode()] = (segment, offset, length)
+        positions[segment] = position + complete
+
+def append(records: List[Tuple[str, bytes]]) -> None:
+    # blocking, run in a thread
+    segments = getSegments()
+    segment = segments[-1] if segments else 1
+    path = segmentPath(segment, "seg")
+    if os.path.exists(path) and os.path.getsize(path) >= config.archive_segment_size:
+        segment += 1
+        path = segmentPath(segment, "seg")
+
+    entries = []
+    with open(path, "ab") as file:
+        offset = file.tell()
+        for game_id, record in records:
+            file.write(record)
+            entries.append(ENTRY.pack(game_id.encode(), offset, len(record)))
+            offset += len(record)
+        file.flush()
+        os.fsync(file.fileno())
+
+    with open(segmentPath(segment, "idx"), "ab") as file:
+        file.write(b"".join(entries))
+        file.flush()
+        os.fsync(file.fileno())
+
+async def store(game_ids: List[str]) -> None:
+    async with db.getSession() as session:
+        games = (await session.execute(
+            select(Game).where(Game.id.in_(game_ids)).options(selectinload(Game.rounds))
+        )).scalars().all()
+
+    records = [(game.id, zlib.compress(serialization.dumps(encoder(game)))) for game in games]
+    if not records:
+        return
+
+    async with appending:
+        await asyncio.to_thread(append, records)
+        refresh()
+
+    stats["archived"] += len(records)
+    stats["bytes"] += sum(len(record) for _, record in records)
+
+def getMap(segment: int, end: int) -> mmap.mmap:
+    mapped = maps.get(segment)
+
+    # the last segment grows, it is mapped again once a record lies past the mapped part
+    if mapped is None or len(mapped) < end:
+        if mapped is not None:
+            mapped.close()
+        with open(segmentPath(segment, "seg"), "rb") as file:
+            mapped = maps[segment] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return mapped
+
+def read(game_id: str) -> Optional[bytes]:
+    # the index is only filled from the sidecars, at startup it is empty
+    if game_id not in index:
+        refresh()
+
+    location = index.get(game_id)
+    if not location:
+        return None
+
+    segment, offset, length = location
+    stats["reads"] += 1
+    return zlib.decompress(getMap(segment, offset + length)[offset:offset + length])
+
+def getStats() -> dict:
+    refresh()
+    return {"segments": len(positions), "games": len(index), "mapped": len(maps), **stats}
@@ -0,0 +1,76 @@
+import datetime
+import sys
+from typing import NamedTuple, Optional
+
+from core import packing
+
+#
+#   Checks the packed form of the rounds: games at the edges of what it holds are packed and
+#   unpacked back to the same rounds, and the ones past them are refused with a ValueError,
+#   which is what the flusher and the compaction job fall back to round rows on.
+#
+#   Run from the repository root: python -m core.check_packing
+#
+
+class Round(NamedTuple):
+    round_number: int
+    player1_choice: Optional[str]
+    player2_choice: Optional[str]
+    player1_score: Optional[int]
+    player2_score: Optional[int]
+    created_at: str
+
+CREATED_AT = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+def at(milliseconds: int) -> str:
+    return str(CREATED_AT + datetime.timedelta(milliseconds=milliseconds))
+
+FITTING = {
+    "no rounds": [],
+    "one round": [Round(1, "RED", "BLUE", 3, -6, at(0))],
+    "unplayed round": [Round(1, None, None, None, None, at(5))],
+    "last round number": [Round(255, "BLUE", None, 127, -127, at(0xFFFFFFFF))],
+    "most rounds": [Round(n, "RED", "RED", n, -n, at(n * 1000)) for n in range(1, packing.MAX_ROUNDS + 1)],
+}
+
+REFUSED = {
+    "round 0": [Round(0, "RED", "RED", 0, 0, at(0))],
+    "negative round": [Round(-1, "RED", "RED", 0, 0, at(0))],
+    "round past 255": [Round(300, "RED", "RED", 0, 0, at(0))],
+    "score past 127": [Round(1, "RED", "RED", 128, 0, at(0))],
+    "score of -128": [Round(1, "RED", "RED", 0, -128, at(0))],
+    "unknown choice": [Round(1, "GREEN", "RED", 0, 0, at(0))],
+    "too many rounds": [Round(n, "RED", "RED", 0, 0, at(0)) for n in range(1, packing.MAX_ROUNDS + 2)],
+}
+
+def main() -> None:
+    failures = []
+
+    for name, rounds in FITTING.items():
+        try:
+            unpacked = packing.unpack(*packing.pack(rounds, CREATED_AT), CREATED_AT)
+        except Exception as e:
+            failures.append(f"{name}: {type(e).__name__}: {e}")
+            continue
+        if [tuple(round) for round in unpacked] != [tuple(round) for round in rounds]:
+            failures.append(f"{name}: unpacked as {unpacked}")
+
+    for name, rounds in REFUSED.items():
+        try:
+            packing.pack(rounds, CREATED_AT)
+            failures.append(f"{name}: packed")
+        except ValueError:
+            pass
+        except Exception as e:
+            failures.append(f"{name}: {type(e).__name__} instead of ValueError: {e}")
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+
+    if failures:
+        sys.exit(1)
+
+    print(f"{len(FITTING)} games packed and unpacked back, {len(REFUSED)} refused.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import asyncio
+import contextvars
+import datetime
+from typing import List, Optional
+
+from sqlalchemy import bindparam, delete, select, tuple_, update
+
+from core import config
+from core import packing
+from core import registry
+from database import session as db
+from database import writer
+from models.game_model import Game
+from models.round_model import Round
+
+#
+#   Background job packing the rounds of the games that finished before packed rounds
+#   existed. It walks the finished games in keyset order, packs a batch at a time onto the
+#   game rows and deletes their round rows in the same transaction, pausing in between like
+#   the retention worker. It runs once at startup, and finds nothing left to do after that.
+#
+
+task: Optional[asyncio.Task] = None
+
+progress = {
+    "running": False,
+    "started_at": None,
+    "finished_at": None,
+    "packed": 0,
+    "skipped": 0,
+    "last_error": None,
+}
+
+async def selectBatch(state: str, after: Optional[tuple]) -> List[tuple]:
+    statement = select(Game.id, Game.created_at).where(Game.game_state == state, Game.packed_rounds.is_(None))
+    if after:
+        statement = statement.where(tuple_(Game.created_at, Game.id) > after)
+
+    async with db.getSession() as session:
+        games = (await session.execute(statement.order_by(Game.created_at, Game.id).limit(config.compaction_batch_size))).all()
+        if not games:
+            return []
+
+        rounds = (await session.execute(select(Round).where(Round.game_id.in_([game.id for game in games])))).scalars().all()
+
+    byGame = {game.id: [] for game in games}
+    for round in rounds:
+        byGame[round.game_id].append(round)
+    return [(game, byGame[game.id]) for game in games]
+
+async def packBatch(batch) -> None:
+    rows = []
+    for game, rounds in batch:
+        # a resident game is packed by the registry when it is flushed
+        if game.id in registry.games:
+            continue
+
+        try:
+            choices, records = packing.pack(rounds, game.created_at)
+        except ValueError:
+            progress["skipped"] += 1
+            continue
+        rows.append({"game_id": game.id, "choices": choices, "records": records})
+
+    if not rows:
+        return
+
+    async def store(session):
+        # only a game still unpacked, so a flush that packed it meanwhile isn't undone
+        await session.execute(
+            update(Game.__table__)
+            .where(Game.id == bindparam("game_id"), Game.packed_rounds.is_(None))
+            .values(round_choices=bindparam("choices"), packed_rounds=bindparam("records")),
+            rows,
+        )
+        await session.execute(delete(Round).where(Round.game_id.in_([row["game_id"] for row in rows])))
+
+    await writer.write(store)
+    progress["packed"] += len(rows)
+
+async def run() -> None:
+    try:
+        for state in registry.FINISHED_STATES:
+            after = None
+            while True:
+                batch = await selectBatch(state, after)
+                if not batch:
+                    break
+
+                await packBatch(batch)
+                after = (batch[-1][0].created_at, batch[-1][0].id)
+                await asyncio.sleep(config.retention_pause)
+    except Exception as e:
+        progress["last_error"] = str(e)
+        print(f"[LOGS]: Packing the finished games failed: {e}")
+    finally:
+        progress["running"] = False
+        progress["finished_at"] = datetime.datetime.now(datetime.timezone.utc)
+
+    if config.debug:
+        print(f"[DEBUG]: Packed the rounds of {progress['packed']} finished games.")
+
+def start() -> None:
+    global task
+    progress.update(running=True, started_at=datetime.datetime.now(datetime.timezone.utc))
+    # not part of the startup it is launched from
+    task = asyncio.create_task(run(), context=contextvars.Context())
+
+def getProgress() -> dict:
+    return dict(progress)
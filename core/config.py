@@ -8,4 +8,96 @@ uvicorn_host = "localhost"
 uvicorn_port = 8000
 
 admin_password = "admin"
-admin_token = uuid.uuid4().hex # resets every time the server is restarted
\ No newline at end of file
+admin_token = uuid.uuid4().hex # resets every time the server is restarted
+
+# SQLite database file, relative to the database/ directory
+database_file = "red-blue.sqlite"
+
+# Database connection pool, a request waits at most db_pool_timeout seconds for a connection
+db_pool_size = 10
+db_max_overflow = 20
+db_pool_timeout = 30
+
+# Pragmas set on every SQLite connection. WAL lets readers run alongside the single writer,
+# busy_timeout (milliseconds) covers the other worker processes writing to the same file
+sqlite_pragmas = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "busy_timeout": 5000,
+}
+
+# Opt-in SQL profiling: statements per route, identical statements repeated sql_repeat_threshold
+# times in one request (a likely N+1), and statements slower than sql_slow_threshold seconds
+# logged with their query plan
+sql_profiling = False
+sql_slow_threshold = 0.05
+sql_repeat_threshold = 3
+
+# Most write jobs committed together in one transaction by the database writer
+writer_group_size = 256
+
+# Live games are kept in memory and written back to the database in batches every flush_interval seconds
+flush_interval = 1.0
+
+# Messages waiting to be sent to a single websocket, a client falling further behind is dropped
+ws_queue_size = 64
+
+# Frames a client sends, to be relayed to the other sockets of its game or as commands. Longer
+# frames are dropped, and each socket may send ws_frame_rate frames a second, in bursts of up
+# to ws_frame_burst. Frames of the ws_coalesced_types are not limited but merged instead, only
+# the latest of each type is relayed every ws_coalesce_interval seconds
+ws_max_frame_size = 4096
+ws_frame_rate = 10.0
+ws_frame_burst = 20
+ws_coalesced_types = ("typing", "hover")
+ws_coalesce_interval = 0.1
+
+# Protocol-level pings uvicorn sends every socket, which browsers answer without any client code.
+# A socket that leaves one unanswered for ws_ping_timeout seconds is closed, and its player disconnected
+ws_ping_interval = 20.0
+ws_ping_timeout = 20.0
+
+# Every ws_heartbeat_interval seconds the sockets are sent a heartbeat message. A client that has
+# echoed one is closed once it sent nothing for ws_idle_timeout seconds, and its player disconnected
+ws_heartbeat_interval = 20.0
+ws_idle_timeout = 60.0
+
+# How websocket messages reach the sockets of a game, "local" (single process) is the only one so far
+broadcast_backend = "local"
+
+# Lobby stream events waiting to be sent to one subscriber before it is cut off, and the
+# seconds between the comments that keep an idle stream open
+lobby_stream_queue_size = 256
+lobby_stream_keepalive = 15.0
+
+# Recent events kept per live game for clients resyncing after a missed sequence number
+event_log_size = 32
+
+# Seconds the total shown by the admin games listing may be out of date
+count_cache_ttl = 30.0
+
+# Age in seconds after which the retention worker deletes or archives a game, by state (None keeps them).
+# Active and paused games are settled by their timers, so they are left alone.
+retention_policies = {
+    "waiting": 3600,
+    "finished": 3600,
+    "abandoned": 3600,
+    "active": None,
+    "pause": None,
+}
+retention_interval = 3600
+
+# Games in these states are moved to the archive when they reach their retention age, rather
+# than deleted: append-only segment files of archive_segment_size bytes at most, in
+# archive_directory (relative to the database/ directory)
+archive_states = ("finished", "abandoned")
+archive_directory = "archive"
+archive_segment_size = 64 * 1024 * 1024
+retention_batch_size = 500
+retention_pause = 0.05
+
+# Finished games whose rounds are packed onto the game row per batch by the compaction job,
+# which pauses retention_pause seconds between batches
+compaction_batch_size = 200
@@ -0,0 +1,154 @@
+import asyncio
+import bisect
+import datetime
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from core import config
+from core import serialization
+from database import session as db
+from misc.functions import decode_cursor, encode_cursor
+from models.game_model import Game
+
+#
+#   Index of the public lobbies waiting for a second player, kept up to date by the registry
+#   whenever a game is saved or removed. The lobby listing is served from here, newest first,
+#   and every change bumps the version used as the listing's ETag. The version starts over at
+#   each boot, so the ETag also carries a nonce of the boot, or a listing cached before a
+#   restart could match a different one after it.
+#
+#   The same changes feed the lobby stream: each one is encoded once as a server-sent event
+#   and queued for every subscriber. A subscriber that falls too far behind is cut off, its
+#   client reconnects and starts again from a snapshot.
+#
+
+lobbies: Dict[str, Tuple[tuple, dict]] = {}
+ordered: List[tuple] = []
+version = 0
+boot = uuid.uuid4().hex[:8]
+
+# serialized pages of the current version, keyed by (cursor, limit)
+pages: Dict[Tuple[Optional[str], int], bytes] = {}
+
+# (version, event) of the snapshot sent to new subscribers
+snapshot: Optional[Tuple[int, bytes]] = None
+
+subscribers = set()
+
+stats = {
+    "events": 0,
+    "dropped_subscribers": 0,
+}
+
+def isListed(game) -> bool:
+    return bool(game.public_lobby) and game.game_state == "waiting"
+
+def sortKey(game) -> tuple:
+    created_at = game.created_at
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+
+    # negated so the newest lobby comes first in ascending order
+    return (-created_at.timestamp(), game.id)
+
+def changed() -> None:
+    global version
+    version += 1
+    pages.clear()
+
+def update(game) -> None:
+    if not isListed(game):
+        discard(game.id)
+        return
+
+    entry = {"id": game.id, "code": game.code, "player1_name": game.player1_name}
+    current = lobbies.get(game.id)
+    if current and current[1] == entry:
+        return
+
+    key = sortKey(game)
+    if current:
+        ordered.remove(current[0])
+    bisect.insort(ordered, key)
+    lobbies[game.id] = (key, entry)
+    changed()
+    publish("add", entry)
+
+def discard(game_id: str) -> None:
+    current = lobbies.pop(game_id, None)
+    if current:
+        ordered.remove(current[0])
+        changed()
+        publish("remove", {"id": game_id})
+
+def encodeEvent(name: str, data) -> bytes:
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (version, name.encode(), serialization.dumps(data))
+
+def publish(name: str, data: dict) -> None:
+    if not subscribers:
+        return
+
+    event = encodeEvent(name, data)
+    stats["events"] += 1
+
+    for queue in list(subscribers):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # None ends the stream once the subscriber reads its way down to it
+            subscribers.discard(queue)
+            queue.get_nowait()
+            queue.put_nowait(None)
+            stats["dropped_subscribers"] += 1
+
+def subscribe() -> Tuple[bytes, asyncio.Queue]:
+    global snapshot
+
+    # every subscriber arriving before the next change gets the same encoded snapshot
+    if snapshot is None or snapshot[0] != version:
+        snapshot = (version, encodeEvent("snapshot", {"games": [lobbies[key[1]][1] for key in ordered]}))
+
+    queue = asyncio.Queue(maxsize=config.lobby_stream_queue_size)
+    subscribers.add(queue)
+    return snapshot[1], queue
+
+def unsubscribe(queue: asyncio.Queue) -> None:
+    subscribers.discard(queue)
+
+def getStats() -> dict:
+    return {"lobbies": len(lobbies), "version": version, "subscribers": len(subscribers), **stats}
+
+def getEtag() -> str:
+    return f'"{boot}-{version}"'
+
+def getPage(cursor: Optional[str], limit: int) -> bytes:
+    if (cursor, limit) in pages:
+        return pages[(cursor, limit)]
+
+    # the cursor is the position of the last lobby of the previous page, so pages stay stable as lobbies come and go
+    start = bisect.bisect_right(ordered, decode_cursor(cursor)) if cursor else 0
+    keys = ordered[start:start + limit]
+
+    page = serialization.dumps({
+        "games": [lobbies[key[1]][1] for key in keys],
+        "next_cursor": encode_cursor(keys[-1]) if len(keys) == limit and start + limit < len(ordered) else None,
+    })
+
+    if len(pages) >= 256:
+        pages.clear()
+    pages[(cursor, limit)] = page
+    return page
+
+async def load() -> None:
+    lobbies.clear()
+    ordered.clear()
+
+    async with db.getSession() as session:
+        games = (await session.execute(
+            select(Game).where(Game.public_lobby == True, Game.game_state == "waiting")
+        )).scalars().all()
+
+    for game in games:
+        update(game)
@@ -0,0 +1,87 @@
+import asyncio
+import collections
+import time
+import uuid
+from typing import Dict, Optional
+
+from core import metrics
+
+#
+#   Matchmaking queue. Players waiting for an opponent are kept in a FIFO per bucket, and
+#   an arriving player is paired with the one who has waited longest. Entering, pairing and
+#   leaving are all O(1), and happen without an await, so two players can't take the same
+#   opponent.
+#
+
+class Ticket:
+    __slots__ = ("id", "player_name", "bucket", "enqueued_at", "match")
+
+    def __init__(self, player_name: str, bucket: str):
+        self.id = uuid.uuid4().hex
+        self.player_name = player_name
+        self.bucket = bucket
+        self.enqueued_at = time.monotonic()
+        # resolved with (game, role) once the player is paired
+        self.match = asyncio.get_running_loop().create_future()
+
+# bucket -> tickets in arrival order, keyed by id so leaving the queue doesn't scan it
+queues: Dict[str, "collections.OrderedDict[str, Ticket]"] = {}
+
+stats = {
+    "entered": 0,
+    "matched": 0,
+    "left": 0,
+    "requeued": 0,
+}
+
+def pair(ticket: Ticket) -> Optional[Ticket]:
+    # the opponent who waited longest, or None once the ticket is queued itself
+    stats["entered"] += 1
+    queue = queues.get(ticket.bucket)
+
+    if queue:
+        opponent = next(iter(queue.values()))
+        if opponent.player_name != ticket.player_name:
+            queue.popitem(last=False)
+            if not queue:
+                del queues[ticket.bucket]
+            return opponent
+
+    queues.setdefault(ticket.bucket, collections.OrderedDict())[ticket.id] = ticket
+    return None
+
+def requeue(ticket: Ticket) -> None:
+    # a pairing whose game couldn't be created gives the opponent its place back
+    queue = queues.setdefault(ticket.bucket, collections.OrderedDict())
+    queue[ticket.id] = ticket
+    queue.move_to_end(ticket.id, last=False)
+    stats["requeued"] += 1
+
+def resolve(ticket: Ticket, game, role: str) -> None:
+    if ticket.match.done():
+        return
+
+    ticket.match.set_result((game, role))
+    stats["matched"] += 1
+    metrics.matchmakingWait.observe(time.monotonic() - ticket.enqueued_at)
+
+def leave(ticket: Ticket) -> None:
+    queue = queues.get(ticket.bucket)
+    if queue and queue.pop(ticket.id, None):
+        stats["left"] += 1
+        if not queue:
+            del queues[ticket.bucket]
+
+def waiting() -> int:
+    return sum(len(queue) for queue in queues.values())
+
+def getStats() -> dict:
+    now = time.monotonic()
+    oldest = [next(iter(queue.values())).enqueued_at for queue in queues.values()]
+
+    return {
+        "waiting": waiting(),
+        "buckets": len(queues),
+        "longest_wait": now - min(oldest) if oldest else 0.0,
+        **stats,
+    }
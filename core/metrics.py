@@ -0,0 +1,155 @@
+import bisect
+import contextvars
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+#
+#   Metrics in the Prometheus text format, without a client library. Recording a value is a
+#   dict lookup and a few additions; the text is only built when /metrics is scraped.
+#
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+# (method, route) -> histogram, and (method, route, status) -> count
+requestDurations: Dict[Tuple[str, str], Histogram] = {}
+requestQueries: Dict[Tuple[str, str], Histogram] = {}
+requestQuerySeconds: Dict[Tuple[str, str], Histogram] = {}
+responses: Dict[Tuple[str, str, int], int] = {}
+
+# "read" or "write" -> histogram of single statements
+queryDurations: Dict[str, Histogram] = {}
+
+broadcastFanout = Histogram()
+
+# from entering the matchmaking queue to being paired, game creation included
+matchmakingWait = Histogram(WAIT_BUCKETS)
+
+# [queries, seconds] of the request being handled, the writes it queued included, the engines add to it
+requestDatabase: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("requestDatabase", default=None)
+
+class MetricsMiddleware:
+    # plain ASGI rather than BaseHTTPMiddleware, which would add a task per request
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def sendWithStatus(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        database = [0, 0.0]
+        token = requestDatabase.set(database)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, sendWithStatus)
+        finally:
+            elapsed = time.perf_counter() - started
+            requestDatabase.reset(token)
+
+            # the route template, not the path, so game ids don't each become a series
+            route = scope.get("route")
+            key = (scope["method"], route.path if route else "unmatched")
+
+            histogram = requestDurations.get(key)
+            if histogram is None:
+                histogram = requestDurations[key] = Histogram()
+                requestQueries[key] = Histogram(COUNT_BUCKETS)
+                requestQuerySeconds[key] = Histogram()
+            histogram.observe(elapsed)
+            requestQueries[key].observe(database[0])
+            requestQuerySeconds[key].observe(database[1])
+
+            response = key + (status[0],)
+            responses[response] = responses.get(response, 0) + 1
+
+def watchEngine(sync_engine, name: str) -> None:
+    histogram = queryDurations[name] = Histogram()
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def beforeExecute(connection, cursor, statement, parameters, context, executemany):
+        connection.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def afterExecute(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info.pop("query_started", time.perf_counter())
+        histogram.observe(elapsed)
+
+        database = requestDatabase.get()
+        if database is not None:
+            database[0] += 1
+            database[1] += elapsed
+
+def labels(**values) -> str:
+    return ",".join(f'{key}="{value}"' for key, value in values.items())
+
+def family(name: str, kind: str, description: str) -> List[str]:
+    return [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+
+def render(gauges: Iterable[Tuple[str, str, str, float]] = ()) -> str:
+    lines = family("redblue_http_request_duration_seconds", "histogram", "Time spent handling HTTP requests.")
+    for (method, route), histogram in sorted(requestDurations.items()):
+        lines += histogram.render("redblue_http_request_duration_seconds", labels(method=method, route=route))
+
+    lines += family("redblue_http_responses_total", "counter", "HTTP responses by status code.")
+    for (method, route, status), count in sorted(responses.items()):
+        lines.append(f"redblue_http_responses_total{{{labels(method=method, route=route, status=status)}}} {count}")
+
+    lines += family("redblue_http_request_db_queries", "histogram", "Database statements run by one HTTP request.")
+    for (method, route), histogram in sorted(requestQueries.items()):
+        lines += histogram.render("redblue_http_request_db_queries", labels(method=method, route=route))
+
+    lines += family("redblue_http_request_db_seconds", "histogram", "Time spent in database statements by one HTTP request.")
+    for (method, route), histogram in sorted(requestQuerySeconds.items()):
+        lines += histogram.render("redblue_http_request_db_seconds", labels(method=method, route=route))
+
+    lines += family("redblue_db_query_duration_seconds", "histogram", "Duration of single database statements.")
+    for name, histogram in sorted(queryDurations.items()):
+        lines += histogram.render("redblue_db_query_duration_seconds", labels(engine=name))
+
+    lines += family("redblue_broadcast_fanout_seconds", "histogram", "Time spent handing a game event to the sockets of the game.")
+    lines += broadcastFanout.render("redblue_broadcast_fanout_seconds", "")
+
+    lines += family("redblue_matchmaking_wait_seconds", "histogram", "Time a player waited in the matchmaking queue for an opponent.")
+    lines += matchmakingWait.render("redblue_matchmaking_wait_seconds", "")
+
+    for name, kind, description, value in gauges:
+        lines += family(name, kind, description)
+        lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,331 @@
+import asyncio
+import collections
+import datetime
+import uuid
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+
+from core import config
+from core import lobbies
+from core import packing
+from database import session as db
+from database import writer
+from models.game_model import ACTIVE_STATES, Game
+from models.round_model import Round
+
+#
+#   Resident registry of the games being played. The live state is held in memory and
+#   served from here, changes are written back to the database in batches by the flusher.
+#
+
+GAME_COLUMNS = tuple(column.name for column in Game.__table__.columns)
+ROUND_COLUMNS = tuple(column.name for column in Round.__table__.columns)
+
+FINISHED_STATES = ("finished", "abandoned")
+
+class LiveRound:
+    __slots__ = ROUND_COLUMNS
+
+    def __init__(self, game_id: str, round_number: int, player1_score: int = 0, player2_score: int = 0):
+        self.id = str(uuid.uuid4())
+        self.game_id = game_id
+        self.round_number = round_number
+        self.player1_choice = None
+        self.player2_choice = None
+        self.player1_score = player1_score
+        self.player2_score = player2_score
+        self.created_at = str(datetime.datetime.now(datetime.timezone.utc))
+
+    @classmethod
+    def fromRow(cls, row) -> "LiveRound":
+        round = cls.__new__(cls)
+        for column in ROUND_COLUMNS:
+            setattr(round, column, row[column])
+        return round
+
+    def toRow(self) -> dict:
+        return {column: getattr(self, column) for column in ROUND_COLUMNS}
+
+class LiveGame:
+    __slots__ = GAME_COLUMNS + ("rounds", "removed_rounds", "events", "version", "snapshot")
+
+    def __init__(self, code: str, player1_name: str):
+        self.id = str(uuid.uuid4())
+        self.code = code
+        self.player1_name = player1_name
+        self.player2_name = None
+        self.player1_score = 0
+        self.player2_score = None
+        self.player1_token = str(uuid.uuid4())
+        self.player2_token = str(uuid.uuid4())
+        self.current_round = 0
+        self.current_round_id = None
+        self.game_state = "waiting"
+        self.public_lobby = False
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.finished_at = None
+        self.player1_disconnected_at = None
+        self.player2_disconnected_at = None
+        self.event_seq = 0
+        self.round_choices = None
+        self.packed_rounds = None
+        self.rounds = []
+        self.removed_rounds = []
+        self.events = collections.deque(maxlen=config.event_log_size)
+        self.version = 0
+        self.snapshot = None
+
+    @classmethod
+    def fromRows(cls, row, round_rows) -> "LiveGame":
+        game = cls.__new__(cls)
+        for column in GAME_COLUMNS:
+            setattr(game, column, row[column])
+        if game.packed_rounds is not None:
+            round_rows = [dict(r._asdict(), id=str(uuid.uuid4()), game_id=game.id) for r in packing.getRounds(game)]
+        game.rounds = sorted((LiveRound.fromRow(r) for r in round_rows), key=lambda r: r.round_number)
+        game.removed_rounds = []
+        game.events = collections.deque(maxlen=config.event_log_size)
+        game.version = 0
+        game.snapshot = None
+        return game
+
+    def toRow(self) -> dict:
+        return {column: getattr(self, column) for column in GAME_COLUMNS}
+
+    def getRound(self, round_number: int) -> Optional[LiveRound]:
+        return next((r for r in self.rounds if r.round_number == round_number), None)
+
+    def addRound(self, round_number: int, player1_score: int = 0, player2_score: int = 0) -> LiveRound:
+        round = LiveRound(self.id, round_number, player1_score, player2_score)
+        self.rounds.append(round)
+        return round
+
+    def removeRound(self, round: LiveRound) -> None:
+        self.rounds.remove(round)
+        self.removed_rounds.append(round.id)
+
+    def addEvent(self, type: str, fields: dict) -> dict:
+        # the recent events are kept so a client that missed some can catch up without a full reload
+        self.event_seq += 1
+        self.version += 1
+        event = {"type": type, "seq": self.event_seq, **fields}
+        self.events.append(event)
+        return event
+
+    def getEventsSince(self, seq: int) -> Optional[list]:
+        if seq >= self.event_seq:
+            return []
+
+        if not self.events or self.events[0]["seq"] > seq + 1:
+            return None
+
+        return [event for event in self.events if event["seq"] > seq]
+
+    def getSnapshot(self, encode: Callable[["LiveGame"], bytes]) -> bytes:
+        # encoded again only once the game changed, polls of an unchanged game get the same bytes
+        if self.snapshot is None or self.snapshot[0] != self.version:
+            self.snapshot = (self.version, encode(self))
+        return self.snapshot[1]
+
+games: Dict[str, LiveGame] = {}
+codes: Dict[str, str] = {}
+
+dirty = set()
+deleted = set()
+loading: Dict[str, asyncio.Future] = {}
+wakeup = asyncio.Event()
+flushing = asyncio.Lock()
+
+def register(game: LiveGame) -> LiveGame:
+    games[game.id] = game
+    if game.game_state in ACTIVE_STATES:
+        codes[game.code] = game.id
+    return game
+
+def forget(game_id: str) -> None:
+    game = games.pop(game_id, None)
+    dirty.discard(game_id)
+    lobbies.discard(game_id)
+    if game and codes.get(game.code) == game_id:
+        del codes[game.code]
+
+async def load(game_id: str) -> Optional[LiveGame]:
+    async with db.getSession() as session:
+        row = (await session.execute(select(Game.__table__).where(Game.id == game_id))).mappings().first()
+        if not row:
+            return None
+
+        # a packed game has no round rows left
+        round_rows = []
+        if row["packed_rounds"] is None:
+            round_rows = (await session.execute(select(Round.__table__).where(Round.game_id == game_id))).mappings().all()
+
+    return LiveGame.fromRows(row, round_rows)
+
+async def getGame(game_id: str) -> Optional[LiveGame]:
+    if game_id in games:
+        return games[game_id]
+
+    if game_id in deleted:
+        return None
+
+    # concurrent requests for a game that isn't resident share one load, so they end up on the same object
+    if game_id in loading:
+        return await asyncio.shield(loading[game_id])
+
+    future = asyncio.get_running_loop().create_future()
+    loading[game_id] = future
+    try:
+        game = await load(game_id)
+        if game and game.game_state not in FINISHED_STATES and game_id not in deleted:
+            # a game may have become resident while loading, e.g. created through a join code lookup
+            game = games.get(game_id) or register(game)
+        future.set_result(game)
+        return game
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        del loading[game_id]
+
+async def getGameByCode(code: str) -> Optional[LiveGame]:
+    if code in codes:
+        return games[codes[code]]
+
+    # the game still using the code comes first, older finished games may share it
+    async with db.getSession() as session:
+        game_id = (await session.execute(
+            select(Game.id).where(Game.code == code, Game.game_state.in_(ACTIVE_STATES))
+        )).scalars().first()
+        if not game_id:
+            game_id = (await session.execute(select(Game.id).where(Game.code == code).limit(1))).scalars().first()
+
+    if not game_id:
+        return None
+
+    return await getGame(game_id)
+
+async def create(game: LiveGame) -> LiveGame:
+    # new games are written straight away, the unique index on active join codes decides collisions.
+    # A game created already started has its first round written in the same transaction
+    async def store(session):
+        await session.execute(insert(Game.__table__).values(game.toRow()))
+        if game.rounds:
+            await session.execute(insert(Round.__table__), [round.toRow() for round in game.rounds])
+
+    await writer.write(store)
+
+    lobbies.update(game)
+    return register(game)
+
+def save(game: LiveGame) -> None:
+    game.version += 1
+    dirty.add(game.id)
+    lobbies.update(game)
+
+    if game.game_state in FINISHED_STATES:
+        if codes.get(game.code) == game.id:
+            del codes[game.code]
+        wakeup.set()
+
+def remove(game: LiveGame) -> None:
+    forget(game.id)
+    deleted.add(game.id)
+    wakeup.set()
+
+async def flush() -> None:
+    # one flush at a time, otherwise an older snapshot could be committed over a newer one
+    async with flushing:
+        await flushBatch()
+
+async def flushBatch() -> None:
+    if not dirty and not deleted:
+        return
+
+    # the rows are built before the first await, so they are a consistent snapshot of the live state
+    flushed = [games[game_id] for game_id in dirty if game_id in games]
+    removed = list(deleted)
+
+    # a finished game is stored with its rounds packed on the game row, in place of its round rows
+    packed = {}
+    for game in flushed:
+        if game.game_state in FINISHED_STATES:
+            try:
+                packed[game.id] = packing.pack(game.rounds, game.created_at)
+            except ValueError:
+                pass
+
+    game_rows = [game.toRow() for game in flushed]
+    for row in game_rows:
+        if row["id"] in packed:
+            row["round_choices"], row["packed_rounds"] = packed[row["id"]]
+    round_rows = [round.toRow() for game in flushed if game.id not in packed for round in game.rounds]
+    removed_rounds = {game.id: game.removed_rounds for game in flushed if game.removed_rounds}
+
+    # cleared only once the rows are built, a game that can't be turned into rows stays dirty
+    dirty.clear()
+    for game in flushed:
+        game.removed_rounds = []
+
+    async def store(session):
+        if removed:
+            await session.execute(delete(Round).where(Round.game_id.in_(removed)))
+            await session.execute(delete(Game).where(Game.id.in_(removed)))
+
+        if removed_rounds:
+            await session.execute(delete(Round).where(Round.id.in_([r for ids in removed_rounds.values() for r in ids])))
+
+        if packed:
+            await session.execute(delete(Round).where(Round.game_id.in_(list(packed))))
+
+        if game_rows:
+            statement = insert(Game.__table__)
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[Game.id],
+                set_={column: statement.excluded[column] for column in GAME_COLUMNS if column != "id"}
+            ), game_rows)
+
+        if round_rows:
+            statement = insert(Round.__table__)
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[Round.id],
+                set_={column: statement.excluded[column] for column in ROUND_COLUMNS if column != "id"}
+            ), round_rows)
+
+    try:
+        await writer.write(store)
+    except Exception as e:
+        # nothing was written, so everything is retried on the next flush
+        dirty.update(game.id for game in flushed)
+        for game in flushed:
+            game.removed_rounds = removed_rounds.get(game.id, []) + game.removed_rounds
+        print(f"[LOGS]: Failed to persist {len(flushed)} games: {e}")
+        return
+
+    # deleted games stay marked until now, so a concurrent lookup can't load them back from the database
+    deleted.difference_update(removed)
+
+    # finished games are not served from memory anymore once they are stored
+    for game in flushed:
+        if game.game_state in FINISHED_STATES and game.id not in dirty:
+            forget(game.id)
+
+    if config.debug:
+        print(f"[DEBUG]: Persisted {len(game_rows)} games and {len(round_rows)} rounds, removed {len(removed)} games.")
+
+async def runFlusher() -> None:
+    while True:
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=config.flush_interval)
+        except asyncio.TimeoutError:
+            pass
+
+        wakeup.clear()
+
+        # shielded so a shutdown doesn't interrupt a batch halfway, the final flush waits for it instead
+        try:
+            await asyncio.shield(flush())
+        except Exception as e:
+            print(f"[LOGS]: Flushing the live games failed: {e}")
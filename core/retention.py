@@ -0,0 +1,120 @@
+import asyncio
+import contextvars
+import datetime
+from typing import List, Optional
+
+from sqlalchemy import delete, select
+
+from core import archive
+from core import config
+from core import registry
+from core import scheduler
+from database import session as db
+from database import writer
+from models.game_model import Game
+from models.round_model import Round
+
+#
+#   Background retention worker. Games older than the age configured for their state are
+#   deleted in bounded batches, each one a couple of set-based deletes in its own short
+#   transaction, with a pause in between so the live games get the write lock back.
+#   Games in one of the archive_states are written to the archive before they are deleted.
+#
+
+task: Optional[asyncio.Task] = None
+
+progress = {
+    "running": False,
+    "runs": 0,
+    "started_at": None,
+    "finished_at": None,
+    "batches": 0,
+    "deleted": {},
+    "archived": {},
+    "last_error": None,
+}
+
+async def selectBatch(state: str, cutoff: datetime.datetime) -> List[str]:
+    async with db.getSession() as session:
+        return (await session.execute(
+            select(Game.id).where(Game.game_state == state, Game.created_at < cutoff).limit(config.retention_batch_size)
+        )).scalars().all()
+
+async def deleteBatch(game_ids: List[str]) -> None:
+    async def remove(session):
+        await session.execute(delete(Round).where(Round.game_id.in_(game_ids)))
+        await session.execute(delete(Game).where(Game.id.in_(game_ids)))
+
+    await writer.write(remove)
+
+async def purgeState(state: str, max_age: float) -> None:
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=max_age)
+
+    while True:
+        game_ids = await selectBatch(state, cutoff)
+        if not game_ids:
+            return
+
+        # archived as stored, so the resident games of the batch are written back first
+        if state in config.archive_states:
+            await registry.flush()
+            await archive.store(game_ids)
+            progress["archived"][state] = progress["archived"].get(state, 0) + len(game_ids)
+
+        # a resident game is removed through the registry, so the flusher doesn't write it back
+        stored = []
+        for game_id in game_ids:
+            scheduler.cancel(game_id)
+            if game_id in registry.games:
+                registry.remove(registry.games[game_id])
+            else:
+                registry.forget(game_id)
+                stored.append(game_id)
+
+        if stored:
+            await deleteBatch(stored)
+
+        progress["batches"] += 1
+        progress["deleted"][state] = progress["deleted"].get(state, 0) + len(game_ids)
+
+        if len(game_ids) < config.retention_batch_size:
+            return
+
+        await asyncio.sleep(config.retention_pause)
+
+async def run() -> None:
+    try:
+        for state, max_age in config.retention_policies.items():
+            if max_age is not None:
+                await purgeState(state, max_age)
+    except Exception as e:
+        progress["last_error"] = str(e)
+        print(f"[LOGS]: Retention run failed: {e}")
+    finally:
+        progress["running"] = False
+        progress["runs"] += 1
+        progress["finished_at"] = datetime.datetime.now(datetime.timezone.utc)
+
+    if config.debug:
+        print(f"[DEBUG]: Retention run deleted {sum(progress['deleted'].values())} games in {progress['batches']} batches.")
+
+def start() -> bool:
+    global task
+
+    if task and not task.done():
+        return False
+
+    # reset before the task gets to run, so the caller already reports the new run
+    progress.update(running=True, started_at=datetime.datetime.now(datetime.timezone.utc), finished_at=None, batches=0, deleted={}, archived={}, last_error=None)
+    # started from a request, but not part of it
+    task = asyncio.create_task(run(), context=contextvars.Context())
+    return True
+
+def getProgress() -> dict:
+    return dict(progress, deleted=dict(progress["deleted"]), archived=dict(progress["archived"]))
+
+async def runRetention() -> None:
+    while True:
+        await asyncio.sleep(config.retention_interval)
+        start()
+        await asyncio.shield(task)
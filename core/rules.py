@@ -0,0 +1,70 @@
+from typing import Iterable, List, Tuple
+
+#
+#   The scoring rules of the game, as pure functions of the choices and round numbers. Nothing
+#   here touches a game object or the database: the routes apply the results to the live game,
+#   and replays or simulations can score any number of rounds without either.
+#
+
+ROUNDS = 10
+
+# rounds from this one on count double
+DOUBLED_FROM = 9
+
+# (player1 choice, player2 choice) -> (player1 points, player2 points) before the multiplier
+PAYOFFS = {
+    ("RED", "RED"): (3, 3),
+    ("BLUE", "RED"): (6, -6),
+    ("RED", "BLUE"): (-6, 6),
+    ("BLUE", "BLUE"): (-3, -3),
+}
+
+# every round left when a player abandons is scored as lost by them and won by the opponent,
+# and the player who abandoned loses ABANDON_PENALTY points on top
+FORFEIT_POINTS = 6
+ABANDON_PENALTY = 24
+
+def multiplier(round_number: int) -> int:
+    return 2 if round_number >= DOUBLED_FROM else 1
+
+# every (player1 choice, player2 choice, round number) of a regular game, so scoring a round is one lookup
+SCORES = {
+    (player1_choice, player2_choice, round_number): (player1_points * multiplier(round_number), player2_points * multiplier(round_number))
+    for (player1_choice, player2_choice), (player1_points, player2_points) in PAYOFFS.items()
+    for round_number in range(1, ROUNDS + 1)
+}
+
+def scoreRound(player1_choice: str, player2_choice: str, round_number: int) -> Tuple[int, int]:
+    scores = SCORES.get((player1_choice, player2_choice, round_number))
+    if scores:
+        return scores
+
+    # the routes accept any round number, the ones outside 1..ROUNDS are scored the same way.
+    # Raises KeyError on a choice outside the rules
+    player1_points, player2_points = PAYOFFS[(player1_choice, player2_choice)]
+    return player1_points * multiplier(round_number), player2_points * multiplier(round_number)
+
+def scoreRounds(plays: Iterable[Tuple[str, str, int]]) -> List[Tuple[int, int]]:
+    # batch form for replays and simulations, raises KeyError on a choice outside the rules
+    return [SCORES.get(play) or scoreRound(*play) for play in plays]
+
+def totals(plays: Iterable[Tuple[str, str, int]]) -> Tuple[int, int]:
+    player1_total = player2_total = 0
+    for player1_points, player2_points in scoreRounds(plays):
+        player1_total += player1_points
+        player2_total += player2_points
+    return player1_total, player2_total
+
+def isLastRound(round_number: int) -> bool:
+    return round_number >= ROUNDS
+
+def forfeitRounds(current_round: int, abandoned_by: int) -> List[Tuple[int, int, int]]:
+    # (round number, player1 points, player2 points) of the rounds after the current one
+    rounds = []
+    for round_number in range(current_round + 1, ROUNDS + 1):
+        points = FORFEIT_POINTS * multiplier(round_number)
+        rounds.append((round_number, -points, points) if abandoned_by == 1 else (round_number, points, -points))
+    return rounds
+
+def abandonPenalty(abandoned_by: int) -> Tuple[int, int]:
+    return (-ABANDON_PENALTY, 0) if abandoned_by == 1 else (0, -ABANDON_PENALTY)
@@ -0,0 +1,187 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.sqlite import insert
+
+from core import config
+from database import session as db
+from database import writer
+from models.timer_model import Timer
+
+#
+#   One scheduler for every game timer (lobby expiry, round timeout, disconnection), instead of
+#   a sleeping task per timer. Timers are keyed by (game_id, kind): scheduling a key again replaces
+#   its deadline. Deadlines are written to the timers table so they survive a restart.
+#
+
+class Entry:
+    __slots__ = ("game_id", "kind", "due", "payload", "cancelled")
+
+    def __init__(self, game_id: str, kind: str, due: float, payload: Optional[int]):
+        self.game_id = game_id
+        self.kind = kind
+        self.due = due
+        self.payload = payload
+        self.cancelled = False
+
+handlers: Dict[str, Callable[[str, Optional[int]], Awaitable[None]]] = {}
+
+entries: Dict[Tuple[str, str], Entry] = {}
+heap = []
+sequence = itertools.count()
+wakeup = asyncio.Event()
+
+# key -> entry to store, or None to delete its row
+writes: Dict[Tuple[str, str], Optional[Entry]] = {}
+
+stats = {
+    "fired": 0,
+    "failed": 0,
+    "last_lateness": 0.0,
+    "max_lateness": 0.0,
+    "total_lateness": 0.0,
+}
+
+def register(kind: str, handler: Callable[[str, Optional[int]], Awaitable[None]]) -> None:
+    handlers[kind] = handler
+
+def push(entry: Entry) -> None:
+    key = (entry.game_id, entry.kind)
+    previous = entries.get(key)
+    if previous:
+        previous.cancelled = True
+
+    entries[key] = entry
+    heapq.heappush(heap, (entry.due, next(sequence), entry))
+
+    # only an earlier deadline than the one being waited for needs to wake the loop up
+    if heap[0][2] is entry:
+        wakeup.set()
+
+def schedule(game_id: str, kind: str, delay: float, payload: Optional[int] = None) -> None:
+    entry = Entry(game_id, kind, time.time() + delay, payload)
+    push(entry)
+    writes[(game_id, kind)] = entry
+
+def cancel(game_id: str, kind: Optional[str] = None) -> None:
+    kinds = [kind] if kind else [k for k in handlers]
+    for k in kinds:
+        entry = entries.pop((game_id, k), None)
+        if entry:
+            entry.cancelled = True
+            writes[(game_id, k)] = None
+
+def pending() -> int:
+    return len(entries)
+
+def getStats() -> dict:
+    return {
+        "pending": len(entries),
+        "queued": len(heap),
+        "fired": stats["fired"],
+        "failed": stats["failed"],
+        "last_lateness": stats["last_lateness"],
+        "max_lateness": stats["max_lateness"],
+        "average_lateness": stats["total_lateness"] / stats["fired"] if stats["fired"] else 0.0,
+    }
+
+async def fire(entry: Entry) -> None:
+    try:
+        await handlers[entry.kind](entry.game_id, entry.payload)
+    except Exception as e:
+        stats["failed"] += 1
+        print(f"[LOGS]: Timer {entry.kind} of game {entry.game_id} failed: {e}")
+
+def fireDue(now: float) -> None:
+    while heap and (heap[0][2].cancelled or heap[0][0] <= now):
+        due, _, entry = heapq.heappop(heap)
+        if entry.cancelled:
+            continue
+
+        del entries[(entry.game_id, entry.kind)]
+        writes[(entry.game_id, entry.kind)] = None
+
+        lateness = now - due
+        stats["fired"] += 1
+        stats["last_lateness"] = lateness
+        stats["max_lateness"] = max(stats["max_lateness"], lateness)
+        stats["total_lateness"] += lateness
+
+        asyncio.create_task(fire(entry))
+
+    # rescheduling leaves cancelled entries behind, rebuild once they outnumber the live ones
+    if len(heap) > 64 and len(heap) > 2 * len(entries):
+        heap[:] = [item for item in heap if not item[2].cancelled]
+        heapq.heapify(heap)
+
+async def flush() -> None:
+    if not writes:
+        return
+
+    batch = dict(writes)
+    writes.clear()
+
+    stored = [
+        {
+            "game_id": entry.game_id,
+            "kind": entry.kind,
+            "due_at": datetime.datetime.fromtimestamp(entry.due, datetime.timezone.utc),
+            "payload": entry.payload,
+        }
+        for entry in batch.values() if entry
+    ]
+    removed = [key for key, entry in batch.items() if entry is None]
+
+    async def store(session):
+        if removed:
+            await session.execute(delete(Timer).where(tuple_(Timer.game_id, Timer.kind).in_(removed)))
+
+        if stored:
+            statement = insert(Timer.__table__)
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[Timer.game_id, Timer.kind],
+                set_={"due_at": statement.excluded.due_at, "payload": statement.excluded.payload}
+            ), stored)
+
+    try:
+        await writer.write(store)
+    except Exception as e:
+        # newer writes for the same keys win over the batch that failed
+        for key, entry in batch.items():
+            writes.setdefault(key, entry)
+        print(f"[LOGS]: Failed to persist {len(batch)} timers: {e}")
+
+async def restore() -> None:
+    async with db.getSession() as session:
+        rows = (await session.execute(select(Timer))).scalars().all()
+
+    for row in rows:
+        due_at = row.due_at
+        if due_at.tzinfo is None:
+            due_at = due_at.replace(tzinfo=datetime.timezone.utc)
+        push(Entry(row.game_id, row.kind, due_at.timestamp(), row.payload))
+
+    if config.debug:
+        print(f"[DEBUG]: Restored {len(rows)} pending timers.")
+
+async def runScheduler() -> None:
+    while True:
+        fireDue(time.time())
+
+        # sleeps until the next deadline, a new earlier one or the next batch of timer writes
+        timeout = heap[0][0] - time.time() if heap else None
+        if writes:
+            timeout = config.flush_interval if timeout is None else min(timeout, config.flush_interval)
+
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        await asyncio.shield(flush())
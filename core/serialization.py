@@ -0,0 +1,23 @@
+import datetime
+import json
+
+# orjson when it is installed, the standard library otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#
+#   JSON encoding of the hot responses and websocket events. Both backends write datetimes
+#   in ISO 8601, like FastAPI's own encoder does.
+#
+
+def encodeDefault(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+def dumps(value) -> bytes:
+    if orjson:
+        return orjson.dumps(value, default=encodeDefault)
+    return json.dumps(value, default=encodeDefault, separators=(",", ":")).encode()
@@ -0,0 +1,85 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+
+from database import migrations
+from database import session as db
+
+# imported so their tables are part of the metadata
+from models import game_model, round_model, timer_model
+
+#
+#   Checks the schema upgrade against a file created by the first release, which had no
+#   versioning: the file is upgraded and compared with a new database created from the
+#   models, table by table, column by column and index by index. A new database skips every
+#   migration step, so only an upgrade shows a step that doesn't apply.
+#
+#   Run from the repository root: python -m database.check_upgrade
+#
+
+BASELINE = [
+    "CREATE TABLE game (id VARCHAR NOT NULL, code VARCHAR NOT NULL, player1_name VARCHAR, player2_name VARCHAR, "
+    "player1_score INTEGER, player2_score INTEGER, player1_token VARCHAR NOT NULL, player2_token VARCHAR NOT NULL, "
+    "current_round INTEGER NOT NULL, current_round_id VARCHAR, game_state VARCHAR DEFAULT 'waiting' NOT NULL, "
+    "public_lobby INTEGER NOT NULL, created_at DATETIME NOT NULL, finished_at DATETIME, player1_disconnected_at DATETIME, "
+    "player2_disconnected_at DATETIME, PRIMARY KEY (id))",
+    "CREATE TABLE rounds (id VARCHAR NOT NULL, game_id VARCHAR NOT NULL, round_number INTEGER NOT NULL, player1_choice VARCHAR, "
+    "player2_choice VARCHAR, player1_score INTEGER, player2_score INTEGER, created_at VARCHAR NOT NULL, PRIMARY KEY (id), "
+    "FOREIGN KEY(game_id) REFERENCES game (id))",
+    # a couple of rounds, the first migration deduplicates them
+    "INSERT INTO game VALUES ('g1', 'ABC', 'one', 'two', 0, 0, 't1', 't2', 1, NULL, 'active', 0, '2024-01-01 00:00:00', NULL, NULL, NULL)",
+    "INSERT INTO rounds VALUES ('r1', 'g1', 1, 'RED', NULL, 0, 0, '2024-01-01 00:00:01')",
+    "INSERT INTO rounds VALUES ('r2', 'g1', 1, 'RED', NULL, 0, 0, '2024-01-01 00:00:02')",
+]
+
+def upgrade(path: str) -> None:
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        migrations.upgradeSchema(connection, db.getBase().metadata)
+    engine.dispose()
+
+def describe(path: str) -> dict:
+    connection = sqlite3.connect(path)
+    try:
+        schema = {"version": connection.execute("PRAGMA user_version").fetchone()[0]}
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+        for table in tables:
+            # column names and types, in any order, since ALTER TABLE appends to the end
+            schema[table] = {
+                "columns": sorted((row[1], row[2].upper()) for row in connection.execute(f"PRAGMA table_info({table})")),
+                "indexes": sorted(row[1] for row in connection.execute(f"PRAGMA index_list({table})") if not row[1].startswith("sqlite_autoindex")),
+            }
+        return schema
+    finally:
+        connection.close()
+
+def main() -> None:
+    directory = tempfile.mkdtemp(prefix="red-blue-upgrade-")
+    baseline = os.path.join(directory, "baseline.sqlite")
+    fresh = os.path.join(directory, "fresh.sqlite")
+
+    connection = sqlite3.connect(baseline)
+    for statement in BASELINE:
+        connection.execute(statement)
+    connection.commit()
+    connection.close()
+
+    upgrade(baseline)
+    upgrade(fresh)
+
+    upgraded, expected = describe(baseline), describe(fresh)
+    differences = [name for name in sorted(set(upgraded) | set(expected)) if upgraded.get(name) != expected.get(name)]
+
+    for name in differences:
+        print(f"{name}:\n  upgraded {upgraded.get(name)}\n  expected {expected.get(name)}", file=sys.stderr)
+
+    if differences:
+        sys.exit(1)
+
+    print(f"Baseline upgraded to version {upgraded['version']}, same schema as a new database.")
+
+if __name__ == "__main__":
+    main()
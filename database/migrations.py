@@ -0,0 +1,71 @@
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.engine import Connection
+
+from core import config
+
+#
+#   Versioned schema changes, applied in order on top of the tables created from the models.
+#   The version of a database file is kept in SQLite's user_version pragma, so each step runs once.
+#   A new database is created from the models as they are now, and starts at the latest version.
+#   python -m database.check_upgrade checks that an upgraded baseline file ends up the same.
+#
+
+migrations = [
+    (1, "indexes for the hot lookup paths", [
+        # rounds could be duplicated by concurrent choices, keep the first one so the unique index can be built
+        "DELETE FROM rounds WHERE rowid NOT IN (SELECT MIN(rowid) FROM rounds GROUP BY game_id, round_number)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_game_code_active ON game (code) WHERE game_state IN ('waiting', 'active', 'pause')",
+        "CREATE INDEX IF NOT EXISTS ix_game_code ON game (code)",
+        "CREATE INDEX IF NOT EXISTS ix_game_public_lobby ON game (public_lobby, game_state, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_game_created_at ON game (created_at)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_rounds_game_round ON rounds (game_id, round_number)",
+    ]),
+    (2, "pending timers of the scheduler", [
+        "CREATE TABLE IF NOT EXISTS timers (game_id VARCHAR NOT NULL, kind VARCHAR NOT NULL, due_at DATETIME NOT NULL, payload INTEGER, PRIMARY KEY (game_id, kind))",
+    ]),
+    (3, "sequence numbers of game events", [
+        "ALTER TABLE game ADD COLUMN event_seq INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (4, "keyset order of the admin games listing", [
+        "CREATE INDEX IF NOT EXISTS ix_game_state_created_at ON game (game_state, created_at, id)",
+        "DROP INDEX IF EXISTS ix_game_created_at",
+        "CREATE INDEX IF NOT EXISTS ix_game_created_at_id ON game (created_at, id)",
+    ]),
+    (5, "packed rounds of finished games", [
+        # the games finished before this are packed by the background job in core/compaction.py
+        "ALTER TABLE game ADD COLUMN round_choices INTEGER",
+        "ALTER TABLE game ADD COLUMN packed_rounds BLOB",
+    ]),
+]
+
+def getSchemaVersion(connection: Connection) -> int:
+    return connection.execute(text("PRAGMA user_version")).scalar_one()
+
+def upgradeSchema(connection: Connection, metadata: MetaData) -> None:
+    fresh = not inspect(connection).has_table("game")
+
+    if fresh:
+        metadata.create_all(connection)
+        connection.execute(text(f"PRAGMA user_version = {migrations[-1][0]}"))
+        return
+
+    # the steps first: create_all would make the tables they add or alter in their current shape
+    runMigrations(connection)
+    metadata.create_all(connection)
+
+def runMigrations(connection: Connection) -> None:
+    version = getSchemaVersion(connection)
+
+    for number, description, statements in migrations:
+        if number <= version:
+            continue
+
+        if config.debug:
+            print(f"[DEBUG]: Applying migration {number} ({description})...")
+
+        for statement in statements:
+            connection.execute(text(statement))
+
+        # pragmas can't be bound as parameters, the number comes from the list above
+        connection.execute(text(f"PRAGMA user_version = {number}"))
+        version = number
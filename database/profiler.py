@@ -0,0 +1,122 @@
+import collections
+import contextvars
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import event
+
+from core import config
+
+#
+#   Opt-in SQL profiler (config.sql_profiling). Every statement is attributed to the route of
+#   the request that ran it, the writes it queued included, or to "background" for the flusher
+#   and timers. Identical statements repeated within one request are reported as a likely N+1,
+#   and statements slower than config.sql_slow_threshold are logged with their EXPLAIN QUERY PLAN.
+#
+
+# statement -> [count, seconds] of the request being handled
+requestStatements: contextvars.ContextVar[Optional[Dict[str, list]]] = contextvars.ContextVar("requestStatements", default=None)
+
+routes: Dict[str, dict] = {}
+slowQueries = collections.deque(maxlen=100)
+
+def getRoute(route: str) -> dict:
+    summary = routes.get(route)
+    if summary is None:
+        summary = routes[route] = {
+            "requests": 0,
+            "statements": 0,
+            "seconds": 0.0,
+            "max_statements": 0,
+            "n_plus_one": 0,
+            "by_statement": {},
+        }
+    return summary
+
+def record(route: str, statements: Dict[str, list]) -> None:
+    summary = getRoute(route)
+    summary["requests"] += 1
+
+    total = 0
+    for statement, (count, seconds) in statements.items():
+        total += count
+        summary["seconds"] += seconds
+
+        totals = summary["by_statement"].setdefault(statement, [0, 0.0])
+        totals[0] += count
+        totals[1] += seconds
+
+        if count >= config.sql_repeat_threshold:
+            summary["n_plus_one"] += 1
+            print(f"[LOGS]: Possible N+1 on {route}: {count}x {statement}")
+
+    summary["statements"] += total
+    summary["max_statements"] = max(summary["max_statements"], total)
+
+def explain(connection, statement: str, parameters) -> list:
+    # straight on the driver connection, so the plan query isn't profiled itself
+    try:
+        cursor = connection.connection.dbapi_connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters or ())
+        plan = [row[-1] for row in cursor.fetchall()]
+        cursor.close()
+        return plan
+    except Exception as e:
+        return [f"unavailable: {e}"]
+
+def watchEngine(sync_engine, name: str) -> None:
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def beforeExecute(connection, cursor, statement, parameters, context, executemany):
+        connection.info["profile_started"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def afterExecute(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info.pop("profile_started", time.perf_counter())
+
+        statements = requestStatements.get()
+        if statements is None:
+            record("background", {statement: [1, elapsed]})
+        else:
+            totals = statements.setdefault(statement, [0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed
+
+        if elapsed >= config.sql_slow_threshold:
+            plan = explain(connection, statement, parameters) if not executemany and statement.lstrip().upper().startswith("SELECT") else []
+            slowQueries.append({"engine": name, "seconds": elapsed, "statement": statement, "plan": plan})
+            print(f"[LOGS]: Slow query on the {name} engine ({elapsed * 1000:.1f} ms): {statement}")
+            for step in plan:
+                print(f"[LOGS]:     {step}")
+
+class ProfilerMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        statements = {}
+        token = requestStatements.set(statements)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            requestStatements.reset(token)
+            route = scope.get("route")
+            record(f"{scope['method']} {route.path if route else 'unmatched'}", statements)
+
+def getReport(top: int = 5) -> dict:
+    report = {}
+    for route, summary in sorted(routes.items(), key=lambda item: -item[1]["seconds"]):
+        heaviest = sorted(summary["by_statement"].items(), key=lambda item: -item[1][1])[:top]
+        report[route] = {
+            "requests": summary["requests"],
+            "statements": summary["statements"],
+            "statements_per_request": summary["statements"] / summary["requests"],
+            "max_statements": summary["max_statements"],
+            "seconds": summary["seconds"],
+            "n_plus_one": summary["n_plus_one"],
+            "heaviest": [{"statement": statement, "count": count, "seconds": seconds} for statement, (count, seconds) in heaviest],
+        }
+
+    return {"enabled": config.sql_profiling, "routes": report, "slow_queries": list(slowQueries)}
@@ -1,47 +1,137 @@
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Connection
+from typing import AsyncIterator
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from core import config
+from core import metrics
+from database import migrations
+from database import profiler
 
 import os
+import time
 
-connection = None
+engine = None
 session = None
+writeEngine = None
+writeSession = None
 base = declarative_base()
 
+poolStats = {
+    "connects": 0,
+    "checkouts": 0,
+    "max_checked_out": 0,
+    "timeouts": 0,
+    "total_wait": 0.0,
+    "max_wait": 0.0,
+}
+
+class TimedPool(AsyncAdaptedQueuePool):
+    # the time spent getting a connection, which is where requests queue once the pool is exhausted
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            poolStats["timeouts"] += 1
+            raise
+        finally:
+            wait = time.perf_counter() - started
+            poolStats["total_wait"] += wait
+            poolStats["max_wait"] = max(poolStats["max_wait"], wait)
+
+def watchPool(pool) -> None:
+    @event.listens_for(pool, "connect")
+    def onConnect(dbapi_connection, connection_record):
+        poolStats["connects"] += 1
+
+    @event.listens_for(pool, "checkout")
+    def onCheckout(dbapi_connection, connection_record, connection_proxy):
+        poolStats["checkouts"] += 1
+        poolStats["max_checked_out"] = max(poolStats["max_checked_out"], pool.checkedout())
+
+def applyPragmas(dbapi_connection, writer: bool) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in config.sqlite_pragmas.items():
+        # the journal mode is stored in the file, only a connection allowed to write may change it
+        if name == "journal_mode" and not writer:
+            continue
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+def watchReader(sync_engine) -> None:
+    @event.listens_for(sync_engine, "connect")
+    def onConnect(dbapi_connection, connection_record):
+        applyPragmas(dbapi_connection, False)
+
+def watchWriter(sync_engine) -> None:
+    @event.listens_for(sync_engine, "connect")
+    def onConnect(dbapi_connection, connection_record):
+        applyPragmas(dbapi_connection, True)
+        # transactions are started below instead of by the driver, which is what makes savepoints work
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(sync_engine, "begin")
+    def onBegin(connection):
+        # takes the write lock up front rather than failing to upgrade a read lock halfway through
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
 def initConnection() -> None:
-    global connection, base, session
+    global engine, base, session, writeEngine, writeSession
 
     from models.game_model import Game
     from models.round_model import Round
+    from models.timer_model import Timer
 
     if config.debug:
         print("[DEBUG]: Initializing connection...")
 
     os.chdir(os.path.dirname(__file__))
-    engine = create_engine("sqlite:///red-blue.sqlite",
-        pool_size=10,
-        max_overflow=20,
-        pool_timeout=30,
+
+    # the schema is created through a short-lived sync engine since this runs before the event loop starts
+    schema_engine = create_engine(f"sqlite:///{config.database_file}")
+    event.listen(schema_engine, "connect", lambda dbapi_connection, connection_record: applyPragmas(dbapi_connection, True))
+    with schema_engine.begin() as schema_connection:
+        migrations.upgradeSchema(schema_connection, base.metadata)
+    schema_engine.dispose()
+
+    # readers get a pool of read-only connections, which WAL lets run alongside the writer
+    engine = create_async_engine(f"sqlite+aiosqlite:///file:{config.database_file}?mode=ro&uri=true",
+        poolclass=TimedPool,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_timeout=config.db_pool_timeout,
         pool_recycle=120
     )
+    watchPool(engine.sync_engine.pool)
+    watchReader(engine.sync_engine)
+    metrics.watchEngine(engine.sync_engine, "read")
 
-    connection = engine.connect()
-    session = sessionmaker(bind=engine)
-    base.metadata.create_all(engine)
+    # every write goes through the single connection of database/writer.py
+    writeEngine = create_async_engine(f"sqlite+aiosqlite:///{config.database_file}", pool_size=1, max_overflow=0)
+    watchWriter(writeEngine.sync_engine)
+    metrics.watchEngine(writeEngine.sync_engine, "write")
+
+    if config.sql_profiling:
+        profiler.watchEngine(engine.sync_engine, "read")
+        profiler.watchEngine(writeEngine.sync_engine, "write")
+
+    # objects are not expired on commit, otherwise every attribute access after a commit would need another await
+    session = async_sessionmaker(bind=engine, expire_on_commit=False)
+    writeSession = async_sessionmaker(bind=writeEngine, expire_on_commit=False)
 
     if config.debug:
         print("[DEBUG]: Initialized connection!")
 
-def getConnection() -> Connection:
-    global connection
+def getEngine() -> AsyncEngine:
+    global engine
 
-    if connection is None:
-        raise Exception("Connection not initialized. Call initConnection() first.")
+    if engine is None:
+        raise Exception("Engine not initialized. Call initConnection() first.")
 
-    return connection
+    return engine
 
 def getBase():
     global base
@@ -51,10 +141,42 @@ def getBase():
 
     return base
 
-def getSession():
+def getSession() -> AsyncSession:
     global session
 
     if session is None:
         raise Exception("Session not initialized. Call initConnection() first.")
-    
-    return session()
\ No newline at end of file
+
+    return session()
+
+
+def getWriteSession() -> AsyncSession:
+    global writeSession
+
+    if writeSession is None:
+        raise Exception("Session not initialized. Call initConnection() first.")
+
+    return writeSession()
+
+async def getRequestSession() -> AsyncIterator[AsyncSession]:
+    # FastAPI dependency: the session lives as long as the request, and is rolled back if the handler fails
+    request_session = getSession()
+    try:
+        yield request_session
+    except Exception:
+        await request_session.rollback()
+        raise
+    finally:
+        await request_session.close()
+
+def getPoolStats() -> dict:
+    pool = getEngine().sync_engine.pool
+    attempts = poolStats["checkouts"] + poolStats["timeouts"]
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        **poolStats,
+        "average_wait": poolStats["total_wait"] / attempts if attempts else 0.0,
+    }
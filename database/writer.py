@@ -0,0 +1,124 @@
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core import config
+from core import metrics
+from database import profiler
+from database import session as db
+
+#
+#   Single writer for the database. Write jobs are queued, and the writer runs every job pending
+#   at that moment on its one connection, each inside a savepoint so a failing job only undoes
+#   itself, then commits them all at once. Writers never contend for the lock among themselves,
+#   and a burst of writes costs one commit instead of one each.
+#
+#   A job is an async function taking the session; it must not commit. write() returns its result
+#   once the group it was part of is committed, or raises its error. The per-request accumulators
+#   in carried are taken over from the caller, so its queries are counted in its request, in the
+#   metrics and the profiler alike.
+#
+
+Job = Callable[[AsyncSession], Awaitable[Any]]
+
+# context variables a job runs with the caller's value of, the writer's own context has none
+carried: List[contextvars.ContextVar] = [metrics.requestDatabase, profiler.requestStatements]
+
+queue: Optional[asyncio.Queue] = None
+task: Optional[asyncio.Task] = None
+
+stats = {
+    "jobs": 0,
+    "failed": 0,
+    "commits": 0,
+    "max_group": 0,
+    "total_commit_time": 0.0,
+    "max_commit_time": 0.0,
+}
+
+async def write(job: Job) -> Any:
+    global queue, task
+
+    if task is None or task.done():
+        queue = asyncio.Queue()
+        # a context of its own, not the one of the request that happened to write first
+        task = asyncio.create_task(runWriter(), context=contextvars.Context())
+
+    future = asyncio.get_running_loop().create_future()
+    queue.put_nowait((job, future, [(variable, variable.get()) for variable in carried]))
+    return await future
+
+@contextmanager
+def restore(values: List[Tuple[contextvars.ContextVar, Any]]):
+    tokens = [(variable, variable.set(value)) for variable, value in values]
+    try:
+        yield
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+async def commitGroup(group: List[Tuple[Job, asyncio.Future, list]]) -> None:
+    results = []
+    started = time.perf_counter()
+
+    try:
+        async with db.getWriteSession() as session:
+            async with session.begin():
+                for job, future, values in group:
+                    try:
+                        async with session.begin_nested():
+                            with restore(values):
+                                results.append((future, await job(session), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+    except Exception as e:
+        # the commit itself failed, so none of the group was written
+        results = [(future, None, e) for _, future, _ in group]
+
+    elapsed = time.perf_counter() - started
+    stats["jobs"] += len(group)
+    stats["commits"] += 1
+    stats["max_group"] = max(stats["max_group"], len(group))
+    stats["total_commit_time"] += elapsed
+    stats["max_commit_time"] = max(stats["max_commit_time"], elapsed)
+
+    for future, result, error in results:
+        if error:
+            stats["failed"] += 1
+        # a caller that gave up waiting doesn't get an answer
+        if future.done():
+            continue
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+async def runWriter() -> None:
+    while True:
+        group = [await queue.get()]
+        while len(group) < config.writer_group_size and not queue.empty():
+            group.append(queue.get_nowait())
+
+        group = [entry for entry in group if not entry[1].cancelled()]
+        if group:
+            await commitGroup(group)
+
+async def stop() -> None:
+    global task
+
+    # callers await their writes, so by shutdown the queue is drained
+    if task:
+        task.cancel()
+        task = None
+
+def getStats() -> dict:
+    return {
+        "queued": queue.qsize() if queue else 0,
+        **stats,
+        "average_group": stats["jobs"] / stats["commits"] if stats["commits"] else 0.0,
+        "average_commit_time": stats["total_commit_time"] / stats["commits"] if stats["commits"] else 0.0,
+    }
@@ -1,6 +1,15 @@
+import base64
+import json
 import random
 import string
 
 # Used to generate random join codes for games
 def generate_game_code():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=9))
\ No newline at end of file
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=9))
+
+# Opaque pagination cursors, the position of the last item of the previous page
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    return tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
@@ -3,11 +3,14 @@ import uuid as uuid
 
 from database import session as db
 
-from sqlalchemy import Column, DateTime, Integer, String
+from sqlalchemy import Column, DateTime, Index, Integer, LargeBinary, String, text
 from sqlalchemy.orm import relationship
 
 Base = db.getBase()
 
+# states in which a join code is still in use, only one game per code may be in one of them
+ACTIVE_STATES = ("waiting", "active", "pause")
+
 class Game(Base):
     __tablename__ = 'game'
     id = Column(String, primary_key=True, nullable=False, default = lambda: str(uuid.uuid4()))
@@ -30,4 +33,20 @@ class Game(Base):
     player1_disconnected_at = Column(DateTime, nullable=True)
     player2_disconnected_at = Column(DateTime, nullable=True)
 
+    # sequence number of the last event broadcast for the game
+    event_seq = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # the rounds of a finished game, packed by core/packing.py in place of its round rows
+    round_choices = Column(Integer, nullable=True)
+    packed_rounds = Column(LargeBinary, nullable=True)
+
     rounds = relationship("Round", back_populates="game")
+
+    # kept in sync with database/migrations.py, which adds them to databases created before they existed
+    __table_args__ = (
+        Index("ux_game_code_active", "code", unique=True, sqlite_where=text("game_state IN ('waiting', 'active', 'pause')")),
+        Index("ix_game_code", "code"),
+        Index("ix_game_public_lobby", "public_lobby", "game_state", "created_at"),
+        Index("ix_game_created_at_id", "created_at", "id"),
+        Index("ix_game_state_created_at", "game_state", "created_at", "id"),
+    )
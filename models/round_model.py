@@ -3,7 +3,7 @@ import uuid as uuid
 
 from database import session as db
 
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 
 Base = db.getBase()
@@ -23,4 +23,9 @@ class Round(Base):
     created_at = Column(String, nullable=False, default = lambda: str(datetime.datetime.now(datetime.timezone.utc)))
 
     game = relationship("Game", back_populates="rounds")
+
+    # also serves the lookups on game_id alone, since it is the leading column
+    __table_args__ = (
+        Index("ux_rounds_game_round", "game_id", "round_number", unique=True),
+    )
     
\ No newline at end of file
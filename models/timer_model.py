@@ -0,0 +1,13 @@
+from database import session as db
+
+from sqlalchemy import Column, DateTime, Integer, String
+
+Base = db.getBase()
+
+class Timer(Base):
+    __tablename__ = 'timers'
+    game_id = Column(String, primary_key=True, nullable=False)
+    kind = Column(String, primary_key=True, nullable=False)
+
+    due_at = Column(DateTime, nullable=False)
+    payload = Column(Integer, nullable=True)
@@ -0,0 +1,37 @@
+from typing import Callable
+
+from core import config
+
+#
+#   Broadcast backends behind notify_game_status. A backend gets every message published for a
+#   game and hands it to deliver() in each process holding sockets for that game. A message
+#   relayed from a client names its sender's connection, which only exists in the publishing
+#   process, so the sender is left out there and nowhere else.
+#
+#   local: a single process, messages are delivered right away (default)
+#
+#   The server runs as one process, so local is the only backend for now. One fanning messages
+#   out between processes belongs with a way to run several, where each game has one owner.
+#
+
+class LocalBackend:
+    def __init__(self, deliver: Callable[..., None]):
+        self.deliver = deliver
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def publish(self, channel: str, message: str, exclude=None) -> None:
+        self.deliver(channel, message, exclude)
+
+    def getStats(self) -> dict:
+        return {"backend": "local"}
+
+def createBackend(deliver: Callable[..., None]):
+    if config.broadcast_backend != "local":
+        raise Exception(f"Unknown broadcast backend '{config.broadcast_backend}'.")
+
+    return LocalBackend(deliver)
@@ -0,0 +1,97 @@
+from typing import Annotated, Literal, Optional, Union
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+from api.routes import game as routes
+from core import registry
+from core import serialization
+
+#
+#   Commands a player sends over the game socket instead of an HTTP request. The socket is
+#   authenticated once when it connects (?token=), so a command names no player or token, and
+#   runs the same handlers as the HTTP endpoints. Every command gets one reply on the socket,
+#   carrying the id it was sent with:
+#
+#   {"type": "choose", "id": "1", "choice": "RED", "round_number": 3}  -> ack (round_number defaults to the current round)
+#   {"type": "abandon", "id": "2"}                                      -> ack
+#   {"type": "ping", "id": "3"}                                         -> pong, with the last event sequence number
+#   {"type": "resync", "id": "4", "since": 12}                          -> resync, with the events or a snapshot
+#
+#   A command that fails gets {"type": "error", "status": ..., "detail": ...} instead.
+#
+
+class Choose(BaseModel):
+    type: Literal["choose"]
+    id: Optional[str] = None
+    choice: str
+    round_number: Optional[int] = None
+
+class Abandon(BaseModel):
+    type: Literal["abandon"]
+    id: Optional[str] = None
+
+class Ping(BaseModel):
+    type: Literal["ping"]
+    id: Optional[str] = None
+
+class Resync(BaseModel):
+    type: Literal["resync"]
+    id: Optional[str] = None
+    since: int = 0
+
+Command = TypeAdapter(Annotated[Union[Choose, Abandon, Ping, Resync], Field(discriminator="type")])
+
+TYPES = ("choose", "abandon", "ping", "resync")
+
+def getPlayer(game, player: int):
+    name, token = (game.player1_name, game.player1_token) if player == 1 else (game.player2_name, game.player2_token)
+    if not name:
+        raise HTTPException(status_code=403, detail="The player is not in the game.")
+    return name, token
+
+async def run(game_id: str, player: int, command) -> bytes:
+    game = await registry.getGame(game_id)
+    if not game:
+        raise HTTPException(status_code=404, detail="Game not found.")
+
+    if isinstance(command, Ping):
+        return serialization.dumps({"type": "pong", "id": command.id, "seq": game.event_seq})
+
+    if isinstance(command, Resync):
+        events = game.getEventsSince(command.since)
+        reply = {"type": "resync", "id": command.id, "seq": game.event_seq}
+        if events is not None:
+            return serialization.dumps(dict(reply, events=events))
+
+        # the cached snapshot is spliced in as it is
+        return serialization.dumps(reply)[:-1] + b',"snapshot":' + game.getSnapshot(routes.encode_game) + b"}"
+
+    name, token = getPlayer(game, player)
+
+    if isinstance(command, Choose):
+        result = await routes.choose_color(routes.ChooseColor(
+            game_id=game_id,
+            round_number=command.round_number or game.current_round,
+            player_name=name,
+            choice=command.choice,
+            token=token,
+        ))
+    else:
+        result = await routes.abandon_game(routes.AbandonGame(game_id=game_id, player_name=name, token=token))
+
+    return serialization.dumps({"type": "ack", "id": command.id, "command": command.type, **result})
+
+def error(id: Optional[str], status: int, detail) -> str:
+    return serialization.dumps({"type": "error", "id": id, "status": status, "detail": detail}).decode()
+
+async def handle(game_id: str, player: int, payload: dict) -> str:
+    try:
+        command = Command.validate_python(payload)
+    except ValidationError as e:
+        return error(payload.get("id"), 400, e.errors(include_url=False))
+
+    try:
+        return (await run(game_id, player, command)).decode()
+    except HTTPException as e:
+        return serialization.dumps({"type": "error", "id": command.id, "command": command.type, "status": e.status_code, "detail": e.detail}).decode()
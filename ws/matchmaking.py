@@ -0,0 +1,99 @@
+import asyncio
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+
+from api.app import getApp
+from api.routes import game as routes
+from core import matchmaking
+from core import registry
+from core import scheduler
+from core import serialization
+
+app = getApp()
+
+#
+#   The matchmaking socket: a player connects with ?player_name= (and optionally &bucket=)
+#   and stays in the queue for as long as the socket is open. Once paired, both players get
+#
+#   {"type": "match_found", "game_id": ..., "code": ..., "role": "player1", "token": ..., "opponent": ...}
+#
+#   and the socket is closed. The game is already active on round 1, the players move on to
+#   /ws/game/{game_id}?token=. Closing the socket before that leaves the queue.
+#
+
+async def waitForMatch(websocket: WebSocket, ticket: matchmaking.Ticket):
+    # the socket is read meanwhile, only to notice the player leaving
+    closed = asyncio.create_task(websocket.receive_text())
+    try:
+        while True:
+            done, _ = await asyncio.wait({ticket.match, closed}, return_when=asyncio.FIRST_COMPLETED)
+            if ticket.match in done:
+                return ticket.match.result()
+
+            try:
+                closed.result()
+            except (WebSocketDisconnect, RuntimeError):
+                return None
+
+            # whatever the player sends while waiting is ignored
+            closed = asyncio.create_task(websocket.receive_text())
+    finally:
+        closed.cancel()
+
+async def startGame(ticket: matchmaking.Ticket, opponent: matchmaking.Ticket) -> bool:
+    try:
+        game = await routes.start_matched_game(opponent.player_name, ticket.player_name)
+    except HTTPException:
+        matchmaking.requeue(opponent)
+        raise
+
+    # the opponent may have left while the game was being stored, the game is dropped then
+    if opponent.match.done():
+        registry.remove(game)
+        scheduler.cancel(game.id)
+        return False
+
+    matchmaking.resolve(opponent, game, "player1")
+    matchmaking.resolve(ticket, game, "player2")
+    return True
+
+@app.websocket("/ws/matchmaking")
+async def matchmaking_websocket(websocket: WebSocket, player_name: str = "", bucket: str = "default"):
+    await websocket.accept()
+
+    try:
+        routes.validate_player_name(player_name)
+    except HTTPException as e:
+        await websocket.send_text(serialization.dumps({"type": "error", "status": e.status_code, "detail": e.detail}).decode())
+        await websocket.close(code=1008)
+        return
+
+    ticket = matchmaking.Ticket(player_name, bucket)
+    try:
+        while not ticket.match.done():
+            opponent = matchmaking.pair(ticket)
+            if not opponent or await startGame(ticket, opponent):
+                break
+
+        result = await waitForMatch(websocket, ticket)
+    except HTTPException as e:
+        await websocket.send_text(serialization.dumps({"type": "error", "status": e.status_code, "detail": e.detail}).decode())
+        await websocket.close(code=1011)
+        return
+    finally:
+        matchmaking.leave(ticket)
+
+    if not result:
+        ticket.match.cancel()
+        return
+
+    game, role = result
+    await websocket.send_text(serialization.dumps({
+        "type": "match_found",
+        "game_id": game.id,
+        "code": game.code,
+        "role": role,
+        "token": game.player1_token if role == "player1" else game.player2_token,
+        "opponent": game.player2_name if role == "player1" else game.player1_name,
+    }).decode())
+    await websocket.close(code=1000)
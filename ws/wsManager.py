@@ -1,47 +1,327 @@
-from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from typing import Dict, Optional
+import asyncio
 import json
+import time
 
 from api.app import getApp
+from core import config
+from core import metrics
+from core import registry
+from core import serialization
+from ws import broadcast
 
 # from api.routes.game import DisconnectGame, disconnect_game
 
 app = getApp()
 
+#
+#   Every socket gets a bounded outbound queue drained by its own writer task, so a broadcast
+#   only enqueues and a slow client can't hold up the others. A client whose queue overflows
+#   is dropped, as is one whose send fails.
+#
+#   Inbound frames are capped in size and rate per socket (a token bucket), and relayed to the
+#   other sockets of the game, never back to the sender.
+#
+#   A socket that dies without closing is found by the pings uvicorn sends (ws_ping_interval),
+#   which every browser answers on its own: a player socket lost that way, or closed without a
+#   close frame, goes through the same disconnect as an explicit disconnect_event. On top of
+#   that, one sweeper sends every socket a heartbeat message. A client that echoes it opts in to
+#   being reaped once it hasn't been heard from in a while, which also catches a page that is
+#   still open but stuck; clients that never echo one are left to the pings.
+#
+
+class Connection:
+    __slots__ = ("websocket", "game_id", "player", "queue", "writer", "tokens", "refilled", "pending", "flusher", "last_seen", "echoing")
+
+    def __init__(self, websocket: WebSocket, game_id: str, player: Optional[int] = None):
+        self.websocket = websocket
+        self.game_id = game_id
+        self.player = player
+        self.queue = asyncio.Queue(maxsize=config.ws_queue_size)
+        self.writer = asyncio.create_task(write(self))
+        self.tokens = float(config.ws_frame_burst)
+        self.refilled = time.monotonic()
+        self.pending: Dict[str, str] = {}
+        self.flusher: Optional[asyncio.TimerHandle] = None
+        self.last_seen = time.monotonic()
+        self.echoing = False
+
 active_connections: Dict[str, set] = {}
 
+stats = {
+    "broadcasts": 0,
+    "messages_queued": 0,
+    "dropped_slow": 0,
+    "dropped_dead": 0,
+    "dropped_idle": 0,
+    "heartbeats": 0,
+    "reaped_players": 0,
+    "commands": 0,
+    "relayed": 0,
+    "coalesced_frames": 0,
+    "throttled_frames": 0,
+    "oversized_frames": 0,
+    "invalid_frames": 0,
+}
+
+def getStats() -> dict:
+    depths = [connection.queue.qsize() for connections in active_connections.values() for connection in connections]
+    return {
+        "games": len(active_connections),
+        "connections": len(depths),
+        "queued_messages": sum(depths),
+        "max_queue_depth": max(depths, default=0),
+        **stats,
+    }
+
+def remove(connection: Connection) -> bool:
+    connections = active_connections.get(connection.game_id)
+    if not connections or connection not in connections:
+        return False
+
+    connections.discard(connection)
+    if not connections:
+        del active_connections[connection.game_id]
+    return True
+
+def drop(connection: Connection, reason: str) -> None:
+    if not remove(connection):
+        return
+
+    stats["dropped_" + reason] += 1
+    connection.writer.cancel()
+    asyncio.create_task(close(connection.websocket))
+
+    if config.debug:
+        print(f"[LOGS]: Dropped a {reason} socket from game {connection.game_id}.")
+
+async def close(websocket: WebSocket) -> None:
+    try:
+        await websocket.close(code=1008)
+    except Exception:
+        pass
+
+async def write(connection: Connection) -> None:
+    try:
+        while True:
+            message = await connection.queue.get()
+            await connection.websocket.send_text(message)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        drop(connection, "dead")
+
+def enqueue(connection: Connection, message: str) -> None:
+    try:
+        connection.queue.put_nowait(message)
+        stats["messages_queued"] += 1
+    except asyncio.QueueFull:
+        drop(connection, "slow")
+
+def deliver(game_id: str, message: str, exclude: Optional[Connection] = None) -> None:
+    started = time.perf_counter()
+
+    # copied since dropping a slow client changes the set
+    connections = list(active_connections.get(game_id, ()))
+    stats["broadcasts"] += 1
+
+    for connection in connections:
+        if connection is not exclude:
+            enqueue(connection, message)
+
+    metrics.broadcastFanout.observe(time.perf_counter() - started)
+
+# reaches the sockets of the game through the configured backend, see ws/broadcast.py
+backend = broadcast.createBackend(deliver)
+
 async def notify_game_status(game_id: str, status_update: dict):
-    if game_id in active_connections:
-        for connection in active_connections[game_id]:
-            await connection.send_text(json.dumps(status_update))
+    # serialized once, whatever the number of sockets in the game
+    backend.publish(game_id, serialization.dumps(status_update).decode())
+
+def allow(connection: Connection) -> bool:
+    now = time.monotonic()
+    connection.tokens = min(config.ws_frame_burst, connection.tokens + (now - connection.refilled) * config.ws_frame_rate)
+    connection.refilled = now
+
+    if connection.tokens < 1:
+        stats["throttled_frames"] += 1
+        return False
+
+    connection.tokens -= 1
+    return True
+
+def relay(connection: Connection, data: str) -> None:
+    stats["relayed"] += 1
+    backend.publish(connection.game_id, data, connection)
+
+def coalesce(connection: Connection, type: str, data: str) -> None:
+    # a newer frame of the same type replaces the one waiting, the others only see the latest
+    if type in connection.pending:
+        stats["coalesced_frames"] += 1
+    elif not connection.pending:
+        connection.flusher = asyncio.get_running_loop().call_later(config.ws_coalesce_interval, flushPending, connection)
+
+    connection.pending[type] = data
+
+def flushPending(connection: Connection) -> None:
+    pending, connection.pending = connection.pending, {}
+    connection.flusher = None
+
+    for data in pending.values():
+        relay(connection, data)
+
+def parseFrame(data: str) -> Optional[dict]:
+    if len(data) > config.ws_max_frame_size:
+        stats["oversized_frames"] += 1
+        return None
+
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        payload = None
+
+    # the events of the server carry a sequence number, a client can't pass one off as its own
+    if not isinstance(payload, dict) or not isinstance(payload.get("type"), str) or "seq" in payload:
+        stats["invalid_frames"] += 1
+        return None
+
+    return payload
+
+HEARTBEAT = serialization.dumps({"type": "heartbeat"}).decode()
+
+async def disconnectPlayer(game_id: str, player: int) -> None:
+    game = await registry.getGame(game_id)
+    if not game:
+        return
+
+    name, token = (game.player1_name, game.player1_token) if player == 1 else (game.player2_name, game.player2_token)
+    if not name:
+        return
+
+    # the player may still be connected through another socket
+    if any(connection.player == player for connection in active_connections.get(game_id, ())):
+        return
+
+    from api.routes.game import DisconnectGame, disconnect_game
+    try:
+        await disconnect_game(DisconnectGame(game_id=game_id, player_name=name, token=token))
+        stats["reaped_players"] += 1
+    except HTTPException:
+        # only games being played are paused, there is nothing to do for the others
+        pass
+
+async def sweep() -> None:
+    cutoff = time.monotonic() - config.ws_idle_timeout
+    idle = []
+
+    for connections in list(active_connections.values()):
+        for connection in list(connections):
+            if connection.echoing and connection.last_seen < cutoff:
+                idle.append(connection)
+            else:
+                enqueue(connection, HEARTBEAT)
+                stats["heartbeats"] += 1
+
+    for connection in idle:
+        drop(connection, "idle")
+
+    for game_id, player in {(c.game_id, c.player) for c in idle if c.player}:
+        await disconnectPlayer(game_id, player)
+
+async def runSweeper() -> None:
+    while True:
+        await asyncio.sleep(config.ws_heartbeat_interval)
+        try:
+            await sweep()
+        except Exception as e:
+            print(f"[LOGS]: Socket sweep failed: {e}")
+
+async def authenticate(game_id: str, token: str) -> Optional[int]:
+    game = await registry.getGame(game_id)
+    if not game:
+        return None
+    if token == game.player1_token:
+        return 1
+    if token == game.player2_token:
+        return 2
+    return None
 
 @app.websocket("/ws/game/{game_id}")
-async def game_websocket(websocket: WebSocket, game_id: str):
+async def game_websocket(websocket: WebSocket, game_id: str, token: str = None):
+    # a socket opened with the player token can send commands, it is checked once here
+    player = None
+    if token:
+        player = await authenticate(game_id, token)
+        if not player:
+            await websocket.close(code=1008)
+            return
+
+    # imported here, the game routes it runs import this module
+    from ws import commands
+
     await websocket.accept()
+    connection = Connection(websocket, game_id, player)
     if game_id not in active_connections:
         active_connections[game_id] = set()
-    active_connections[game_id].add(websocket)
+    active_connections[game_id].add(connection)
 
+    abnormal = False
     try:
         while True:
             data = await websocket.receive_text()
-            try:
-                payload = json.loads(data)
-                if payload.get("type") == "disconnect_event":
-                    if payload.get("player_name") and payload.get("token"):
-                        from api.routes.game import DisconnectGame, disconnect_game
-                        disconnect_request = DisconnectGame(
-                            game_id=game_id,
-                            player_name=payload.get("player_name"),
-                            token=payload.get("token")
-                        )
+            connection.last_seen = time.monotonic()
+
+            payload = parseFrame(data)
+            if payload is None:
+                continue
+            if payload["type"] == "heartbeat":
+                connection.echoing = True
+                continue
+
+            if payload["type"] in config.ws_coalesced_types:
+                coalesce(connection, payload["type"], data)
+                continue
+
+            if not allow(connection):
+                if payload["type"] in commands.TYPES:
+                    enqueue(connection, commands.error(payload.get("id"), 429, "Too many frames, slow down."))
+                continue
+
+            if payload["type"] in commands.TYPES:
+                # answered to this socket only, what the command changed reaches everyone as an event
+                stats["commands"] += 1
+                if player:
+                    enqueue(connection, await commands.handle(game_id, player, payload))
+                else:
+                    enqueue(connection, commands.error(payload.get("id"), 401, "Connect with ?token= to send commands."))
+                continue
+
+            if payload["type"] == "disconnect_event":
+                # not relayed, it carries the token and the others get a player_disconnected event
+                if payload.get("player_name") and payload.get("token"):
+                    from api.routes.game import DisconnectGame, disconnect_game
+                    disconnect_request = DisconnectGame(
+                        game_id=game_id,
+                        player_name=payload.get("player_name"),
+                        token=payload.get("token")
+                    )
+                    try:
                         await disconnect_game(disconnect_request)
-            except Exception as e:
-                print("Error parsing JSON:", e)
-
-            for connection in active_connections[game_id]:
-                await connection.send_text(data)
-    except WebSocketDisconnect:
-        active_connections[game_id].remove(websocket)
-        if not active_connections[game_id]:
-            del active_connections[game_id]
+                    except Exception as e:
+                        print("Error handling the disconnect event:", e)
+                continue
+
+            relay(connection, data)
+    except WebSocketDisconnect as e:
+        # closed without a close frame (1006) or after unanswered pings (1011). Not any other code:
+        # a plain close() from the page is 1005, and a server restart closes every socket with 1012
+        abnormal = e.code in (1006, 1011)
+    finally:
+        remove(connection)
+        connection.writer.cancel()
+        if connection.flusher:
+            connection.flusher.cancel()
+
+    if abnormal and player:
+        await disconnectPlayer(game_id, player)